@@ -1,125 +1,108 @@
 import io
 import os
-import struct
 import numpy as np
-import subprocess
 from typing import Any, List
 from PIL import Image
 import torch
-try:
-    import moviepy
-    from moviepy.editor import VideoFileClip
-except ImportError:
-    try:
-        import moviepy
-        from moviepy import VideoFileClip
-    except ImportError:
-        print("❌ MoviePy import failed in duck_decode_node.")
-        VideoFileClip = None
 try:
     import folder_paths  # type: ignore
 except Exception:
     folder_paths = None
 
-CATEGORY = "SSTool"
-WATERMARK_SKIP_W_RATIO = 0.40
-WATERMARK_SKIP_H_RATIO = 0.08
-
-def _extract_payload_with_k(arr: np.ndarray, k: int) -> bytes:
-    h, w, c = arr.shape
-    skip_w = int(w * WATERMARK_SKIP_W_RATIO)
-    skip_h = int(h * WATERMARK_SKIP_H_RATIO)
-    mask2d = np.ones((h, w), dtype=bool)
-    if skip_w > 0 and skip_h > 0:
-        mask2d[:skip_h, :skip_w] = False
-    mask3d = np.repeat(mask2d[:, :, None], c, axis=2)
-    flat = arr.reshape(-1)
-    idxs = np.flatnonzero(mask3d.reshape(-1))
-    vals = (flat[idxs] & ((1 << k) - 1)).astype(np.uint8)
-    ub = np.unpackbits(vals, bitorder="big").reshape(-1, 8)[:, -k:]
-    bits = ub.reshape(-1)
-    if len(bits) < 32:
-        raise ValueError("Insufficient image data. 图像数据不足")
-    len_bits = bits[:32]
-    length_bytes = np.packbits(len_bits, bitorder="big").tobytes()
-    header_len = struct.unpack(">I", length_bytes)[0]
-    total_bits = 32 + header_len * 8
-    if header_len <= 0 or total_bits > len(bits):
-        raise ValueError("Payload length invalid. 载荷长度异常")
-    payload_bits = bits[32:32 + header_len * 8]
-    return np.packbits(payload_bits, bitorder="big").tobytes()
-
-def _generate_key_stream(password: str, salt: bytes, length: int) -> bytes:
-    import hashlib
-    key_material = (password + salt.hex()).encode("utf-8")
-    out = bytearray()
-    counter = 0
-    while len(out) < length:
-        out.extend(hashlib.sha256(key_material + str(counter).encode("utf-8")).digest())
-        counter += 1
-    return bytes(out[:length])
-
-def _parse_header(header: bytes, password: str):
-    idx = 0
-    if len(header) < 1:
-        raise ValueError("Header corrupted. 文件头损坏")
-    has_pwd = header[0] == 1
-    idx += 1
-    pwd_hash = b""
-    salt = b""
-    if has_pwd:
-        if len(header) < idx + 32 + 16:
-            raise ValueError("Header corrupted. 文件头损坏")
-        pwd_hash = header[idx:idx + 32]; idx += 32
-        salt = header[idx:idx + 16]; idx += 16
-    if len(header) < idx + 1:
-        raise ValueError("Header corrupted. 文件头损坏")
-    ext_len = header[idx]; idx += 1
-    if len(header) < idx + ext_len + 4:
-        raise ValueError("Header corrupted. 文件头损坏")
-    ext = header[idx:idx + ext_len].decode("utf-8", errors="ignore"); idx += ext_len
-    data_len = struct.unpack(">I", header[idx:idx + 4])[0]; idx += 4
-    data = header[idx:]
-    if len(data) != data_len:
-        raise ValueError("Data length mismatch. 数据长度不匹配")
-    if not has_pwd:
-        return data, ext
-    if not password:
-        raise ValueError("Password required. 需要密码")
-    import hashlib
-    check_hash = hashlib.sha256((password + salt.hex()).encode("utf-8")).digest()
-    if check_hash != pwd_hash:
-        raise ValueError("Wrong password. 密码错误")
-    ks = _generate_key_stream(password, salt, len(data))
-    plain = bytes(a ^ b for a, b in zip(data, ks))
-    return plain, ext
+try:
+    from .duck_payload_exporter import (
+        _binary_image_to_bytes, _detect_lsb_depths, _extract_payload_with_k, _parse_header,
+    )
+except ImportError:
+    from duck_payload_exporter import (
+        _binary_image_to_bytes, _detect_lsb_depths, _extract_payload_with_k, _parse_header,
+    )
+try:
+    from .duck_ffmpeg import VIDEO_READ_CHUNK_BYTES, RawVideoReader, frame_window_filter, probe_video
+except ImportError:
+    from duck_ffmpeg import VIDEO_READ_CHUNK_BYTES, RawVideoReader, frame_window_filter, probe_video
 
-def _tensor_to_pil(image: torch.Tensor) -> Image.Image:
+CATEGORY = "SSTool"
+def _tensor_to_rgb_array(image: torch.Tensor) -> np.ndarray:
+    """
+    IMAGE 张量直接转为 (H, W, 3) uint8 数组，不经过 PIL。
+    先挑出要用的通道再量化，缩放、截断、取整都在同一个浮点缓冲上原地完成。
+    """
     if image.dim() == 4:
         image = image[0]
-    arrf = image.detach().cpu().numpy() * 255.0
-    arru = np.rint(np.clip(arrf, 0, 255)).astype(np.uint8)
+    arrf = image.detach().cpu().numpy()
+    if arrf.ndim == 3 and arrf.shape[-1] != 3:
+        # RGBA 及更多通道只取前三个（与转 RGB 时丢弃 alpha 一致），单/双通道按灰度处理
+        arrf = arrf[..., :3] if arrf.shape[-1] > 3 else arrf[..., 0]
+    # 乘法产生新缓冲，不会改写张量本身
+    arrf = arrf * 255.0
+    np.clip(arrf, 0, 255, out=arrf)
+    np.rint(arrf, out=arrf)
+    arru = arrf.astype(np.uint8)
+    del arrf
     if arru.ndim == 2:
-        arru = np.stack([arru, arru, arru], axis=-1)
-        return Image.fromarray(arru, mode="RGB")
-    if arru.shape[-1] == 3:
-        return Image.fromarray(arru, mode="RGB")
-    if arru.shape[-1] == 4:
-        return Image.fromarray(arru, mode="RGBA")
-    if arru.shape[-1] > 4:
-        return Image.fromarray(arru[..., :3], mode="RGB")
-    return Image.fromarray(np.repeat(arru[..., :1], 3, axis=-1), mode="RGB")
+        arru = np.repeat(arru[..., None], 3, axis=-1)
+    return arru
 
 
 def _pil_to_tensor(image: Image.Image) -> torch.Tensor:
     arr = np.array(image).astype(np.float32) / 255.0
     return torch.from_numpy(arr)[None, ...]
 
-def binpng_bytes_to_mp4_bytes(p: str) -> bytes:
-    img = Image.open(p).convert("RGB")
-    arr = np.array(img).astype(np.uint8)
-    flat = arr.reshape(-1, 3).reshape(-1)
-    return flat.tobytes().rstrip(b"\x00")
+def _available_memory_bytes():
+    """Linux 下读取 /proc/meminfo 的 MemAvailable，其他平台返回 None。"""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _plan_video_frames(info, start_frame: int, end_frame: int, frame_stride: int, max_frames: int,
+                       target_width: int, target_height: int):
+    """
+    按帧窗口、抽帧步长、帧数上限和目标分辨率算出实际输出，返回 (帧数, 宽, 高, 滤镜串)。
+    - end_frame：结束帧（不含），0 表示到最后一帧
+    - target_width / target_height：0 表示不缩放；只填一个时按原宽高比计算另一个
+    """
+    stop = min(end_frame, info.frame_count) if end_frame > 0 else info.frame_count
+    if start_frame >= stop:
+        raise ValueError(
+            f"Empty frame window: start {start_frame}, end {stop}, video has {info.frame_count} frames. "
+            f"帧窗口为空，视频共 {info.frame_count} 帧"
+        )
+    count = len(range(start_frame, stop, frame_stride))
+    if max_frames > 0:
+        count = min(count, max_frames)
+    width, height = info.width, info.height
+    if target_width > 0 or target_height > 0:
+        width = target_width or max(1, round(info.width * target_height / info.height))
+        height = target_height or max(1, round(info.height * target_width / info.width))
+    size = (width, height) if (width, height) != (info.width, info.height) else None
+    vf = frame_window_filter(start_frame, stop if stop < info.frame_count else None, frame_stride, size)
+    return count, width, height, vf
+
+
+def _check_video_memory(count: int, width: int, height: int, max_memory_mb: int) -> None:
+    """分配前估算输出张量与解码缓冲的内存，超过 max_memory_mb（0 则取当前可用内存）时直接报错。"""
+    frame_bytes = width * height * 3
+    estimate = count * frame_bytes * 4 + min(VIDEO_READ_CHUNK_BYTES, count * frame_bytes)
+    limit = max_memory_mb * (1 << 20) if max_memory_mb > 0 else _available_memory_bytes()
+    print(f"[DuckDecode] {count} frames {width}x{height} float32, estimated memory {estimate / (1 << 20):.0f} MB")
+    if limit is not None and estimate > limit:
+        raise ValueError(
+            f"Decoded video needs about {estimate / (1 << 20):.0f} MB but only {limit / (1 << 20):.0f} MB is allowed; "
+            f"reduce the frame window, raise frame_stride / lower max_frames, or set a smaller target resolution. "
+            f"解码视频约需 {estimate / (1 << 20):.0f} MB，超过上限 {limit / (1 << 20):.0f} MB，请缩小帧范围、加大抽帧步长或降低分辨率"
+        )
+
+
+def binpng_bytes_to_mp4_bytes(p) -> bytes:
+    """旧版 .binpng 载荷（视频包装成的二进制图片）还原为视频字节；p 可以是路径或文件对象。"""
+    return _binary_image_to_bytes(p)
 
 class DuckDecodeNode:
     @classmethod
@@ -131,7 +114,13 @@ class DuckDecodeNode:
             },
             "optional": {
                 "password": ("STRING", {"default": "", "multiline": False}),
-
+                "start_frame": ("INT", {"default": 0, "min": 0, "max": 1000000, "step": 1, "tooltip": "视频从第几帧开始读取"}),
+                "end_frame": ("INT", {"default": 0, "min": 0, "max": 1000000, "step": 1, "tooltip": "读到第几帧为止（不含），0 为读到最后"}),
+                "frame_stride": ("INT", {"default": 1, "min": 1, "max": 1000, "step": 1, "tooltip": "每隔几帧取一帧，输出帧率按此降低"}),
+                "max_frames": ("INT", {"default": 0, "min": 0, "max": 1000000, "step": 1, "tooltip": "最多输出的帧数，0 为不限"}),
+                "target_width": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "输出帧宽度，0 为不缩放；只填宽或高时保持宽高比"}),
+                "target_height": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "输出帧高度，0 为不缩放；只填宽或高时保持宽高比"}),
+                "max_memory_mb": ("INT", {"default": 0, "min": 0, "max": 1048576, "step": 1, "tooltip": "视频帧允许占用的内存上限（MB），0 为当前可用内存"}),
             },
         }
 
@@ -140,15 +129,16 @@ class DuckDecodeNode:
     FUNCTION = "decode"
     CATEGORY = CATEGORY
 
-    def decode(self, image: torch.Tensor, password: str = "",Notes: str = ""):
-        pil = _tensor_to_pil(image)
-        arr = np.array(pil.convert("RGB")).astype(np.uint8)
+    def decode(self, image: torch.Tensor, password: str = "",Notes: str = "",
+               start_frame: int = 0, end_frame: int = 0, frame_stride: int = 1, max_frames: int = 0,
+               target_width: int = 0, target_height: int = 0, max_memory_mb: int = 0):
+        arr = _tensor_to_rgb_array(image)
         header = None
         raw = None
         ext = None
         last_err = None
         text_output = ""
-        for k in (2, 6, 8):
+        for k in _detect_lsb_depths(arr):
             try:
                 header = _extract_payload_with_k(arr, k)
                 raw, ext = _parse_header(header, password)
@@ -167,11 +157,8 @@ class DuckDecodeNode:
         final_path = ""
         final_ext = ext
         if ext.endswith(".binpng"):
-            tmp_png = out_path + ".binpng"
-            with open(tmp_png, "wb") as f:
-                f.write(raw)
-            mp4_bytes = binpng_bytes_to_mp4_bytes(tmp_png)
-            os.unlink(tmp_png)
+            # 兼容旧版鸭子图：视频被包装成二进制图片，直接在内存中还原
+            mp4_bytes = binpng_bytes_to_mp4_bytes(io.BytesIO(raw))
             final_path = out_path + ".mp4"
             with open(final_path, "wb") as f:
                 f.write(mp4_bytes)
@@ -196,142 +183,49 @@ class DuckDecodeNode:
         fps_out = 0
         if final_ext.lower() == "png":
             img_tensor = _pil_to_tensor(Image.open(final_path).convert("RGB"))
-        elif final_ext.lower() == "mp4":
-            clip = VideoFileClip(final_path)
-            fps_out = int(round(clip.fps)) if clip.fps else 0
-            # 优化：直接使用 reader.nframes 或 duration * fps 计算总帧数，不再依赖 ffprobe
-            frame_count = 0
-            if hasattr(clip, 'reader') and hasattr(clip.reader, 'nframes') and clip.reader.nframes:
-                 frame_count = clip.reader.nframes
-            else:
-                 # Fallback: 使用 round 避免浮点精度导致的少帧问题
-                 frame_count = int(round(clip.duration * max(1, fps_out)))
-            
+        elif final_ext.lower() in ("mp4", "avi", "mov"):
+            info = probe_video(final_path)
+            # 抽帧后按步长降低帧率，保持播放时长不变
+            fps_out = max(1, int(round(info.fps / frame_stride))) if info.fps else 0
             img_tensor = None
-            
-            if frame_count > 0:
-                try:
-                    # 获取第一帧以确定尺寸
-                    # 优先使用 iter_frames 获取第一帧，避免 seek
-                    first_frame_iter = clip.iter_frames(fps=None)
-                    first_frame = next(first_frame_iter)
-                    h, w, c = first_frame.shape
-                    # 预分配内存：直接申请最终所需空间，避免 List + Stack 的双倍内存峰值
-                    img_tensor = torch.zeros((frame_count, h, w, c), dtype=torch.float32)
-                except Exception as e:
-                    print(f"Error initializing video tensor: {e}")
-                    img_tensor = None
-
-            if img_tensor is None:
-                img_tensor = torch.zeros((1, 1, 1, 3), dtype=torch.float32)
-            else:
-                # 使用 iter_frames 顺序读取，比 get_frame(t) 更快更准
-                # fps=None 表示输出原始帧
-                for i, frame in enumerate(clip.iter_frames(fps=None)):
-                    if i >= frame_count:
-                        break
-                    try:
-                        # 直接写入预分配位置，不产生额外的 Tensor 副本
-                        # 修复 numpy 不可写警告：先复制一份数据
-                        frame_copy = frame.copy()
-                        img_tensor[i] = torch.from_numpy(frame_copy).float().div(255.0)
-                    except Exception as e:
-                        print(f"Frame decode error at index {i}: {e}")
-                        continue
-            
-            if clip.audio is not None:
-                # todo 这个部分与RH平台存在包冲突
-                try:
-                    sr_attr = getattr(clip.audio, "fps", None)
-                    sr = int(round(sr_attr)) if sr_attr else 44100
-                    
-                    audio_np = None
-                    
-                    # 判断 MoviePy 版本，如果是 1.x 则直接使用 ffmpeg 提取
-                    is_moviepy_1x = False
-                    if hasattr(moviepy, "__version__") and moviepy.__version__.startswith("1."):
-                        is_moviepy_1x = True
-                    
-                    if is_moviepy_1x:
-                        try:
-                            # 使用 ffmpeg 直接提取音频为 raw float32 pcm
-                            # -vn: 禁用视频
-                            # -f f32le: 输出格式 float32 little endian
-                            # -acodec pcm_f32le: 编码器
-                            # -ar {sr}: 采样率
-                            # -ac 2: 声道数 (强制双声道以简化处理，或者先探测？这里假设双声道通用)
-                            # -: 输出到 stdout
-                            cmd = [
-                                "ffmpeg",
-                                "-v", "error",
-                                "-i", final_path,
-                                "-vn",
-                                "-f", "f32le",
-                                "-acodec", "pcm_f32le",
-                                "-ar", str(sr),
-                                "-ac", "2",
-                                "-"
-                            ]
-                            # 运行命令并获取输出
-                            process = subprocess.run(cmd, capture_output=True, check=True)
-                            raw_audio = process.stdout
-                            
-                            if raw_audio:
-                                audio_np = np.frombuffer(raw_audio, dtype=np.float32)
-                                audio_np = audio_np.reshape(-1, 2) # 重塑为 (Samples, Channels=2)
-                        except Exception as e:
-                            print(f"FFmpeg audio extraction failed: {e}")
-                            audio_np = None
-
-                    # 如果不是 1.x 或者 ffmpeg 失败，尝试原有的 moviepy 逻辑 (作为 fallback 或主逻辑)
-                    if audio_np is None and not is_moviepy_1x:
-                        try:
-                            audio_np = clip.audio.to_soundarray(fps=sr, nbytes=4)
-                        except Exception:
-                            pass
-                        
-                        if audio_np is None:
-                            # Fallback: 手动读取音频块
-                            try:
-                                chunks = []
-                                iterator = None
-                                try:
-                                    iterator = clip.audio.iter_chunks(fps=sr, nbytes=4, quantize=False)
-                                except TypeError:
-                                    iterator = clip.audio.iter_chunks(fps=sr)
-                                
-                                if iterator:
-                                    for chunk in iterator:
-                                        chunks.append(chunk)
-                                
-                                if len(chunks) > 0:
-                                    audio_np = np.vstack(chunks)
-                            except Exception as e:
-                                print(f"Manual audio chunk read failed: {e}")
-                        
-                        if audio_np is None:
-                             try:
-                                 audio_np = clip.audio.to_soundarray()
-                             except Exception:
-                                 pass
-
+            if info.frame_count > 0:
+                count, width, height, vf = _plan_video_frames(
+                    info, start_frame, end_frame, frame_stride, max_frames, target_width, target_height
+                )
+                _check_video_memory(count, width, height, max_memory_mb)
+                # 音频截取与帧窗口覆盖的时间段一致
+                span_end = min(start_frame + count * frame_stride, info.frame_count)
+                windowed = start_frame > 0 or span_end < info.frame_count
+                reader = RawVideoReader(
+                    final_path, width, height, max_frames=count, vf=vf, with_audio=info.has_audio,
+                    audio_start=start_frame / info.fps if info.fps else 0.0,
+                    audio_duration=(span_end - start_frame) / info.fps if windowed and info.fps else None,
+                )
+                # 按最终帧数和尺寸一次性预分配，跳过的帧在 ffmpeg 内丢弃、缩放也在 ffmpeg 内完成
+                img_tensor = torch.empty((count, height, width, 3), dtype=torch.float32)
+                filled = 0
+                for chunk in reader:
+                    n = chunk.shape[0]
+                    # copy_ 直接按目标类型转换写入，再原地缩放，不产生整块的浮点临时张量
+                    img_tensor[filled:filled + n].copy_(torch.from_numpy(chunk)).div_(255.0)
+                    filled += n
+                if filled < count:
+                    # 实际解出的帧比头部记录的少时丢掉未填充的部分
+                    img_tensor = img_tensor[:filled]
+
+                if info.has_audio:
+                    audio_np = reader.audio
                     if audio_np is None:
-                         print("Audio decoding completely failed, returning silent audio.")
-                         audio_np = np.zeros((sr, 2), dtype=np.float32)
-
+                        print("Audio decoding completely failed, returning silent audio.")
+                        audio_np = np.zeros((info.sample_rate, 2), dtype=np.float32)
                     # 归一化处理
-                    max_val = np.max(np.abs(audio_np))
+                    max_val = np.max(np.abs(audio_np)) if audio_np.size else 0
                     if max_val > 0:
                         audio_np = audio_np / max_val
-
-                    if len(audio_np.shape) == 1:
-                        audio_np = np.expand_dims(audio_np, axis=1)
-                    wf = torch.from_numpy(audio_np.T.astype(np.float32)).unsqueeze(0)
-                    audio_out = {"waveform": wf, "sample_rate": sr}
-                except Exception as e:
-                    audio_out = None
-                    print(f"Audio decode error: {e}")
-            clip.close()
+                    wf = torch.from_numpy(np.ascontiguousarray(audio_np.T, dtype=np.float32)).unsqueeze(0)
+                    audio_out = {"waveform": wf, "sample_rate": info.sample_rate}
+            if img_tensor is None or img_tensor.shape[0] == 0:
+                img_tensor = torch.zeros((1, 1, 1, 3), dtype=torch.float32)
         else:
             img_tensor = torch.zeros((1, 1, 1, 3), dtype=torch.float32)
 
@@ -4,29 +4,20 @@ import os
 import os
 import struct
 from typing import Tuple, List, Any
-try:
-    from moviepy.editor import ImageSequenceClip, AudioFileClip, concatenate_audioclips
-except ImportError:
-    try:
-        from moviepy import ImageSequenceClip, AudioFileClip, concatenate_audioclips
-    except ImportError:
-        print("❌ MoviePy import failed. Please install moviepy: pip install moviepy")
-        ImageSequenceClip = None
-        AudioFileClip = None
-        concatenate_audioclips = None
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import torch
-import tempfile
 try:
     import folder_paths  # type: ignore
 except Exception:  # pragma: no cover
     folder_paths = None
 
 try:
-    from .duck_payload_exporter import export_duck_payload, _bytes_to_binary_image, _required_canvas_size, _build_file_header
+    from .duck_payload_exporter import export_duck_payload, _required_canvas_size, _build_file_header
+    from .duck_ffmpeg import DEFAULT_X264_PRESET, VIDEO_FRAME_BATCH, X264_PRESETS, encode_rgb_video, probe_audio_duration
 except ImportError:
-    from duck_payload_exporter import export_duck_payload, _bytes_to_binary_image, _required_canvas_size, _build_file_header
+    from duck_payload_exporter import export_duck_payload, _required_canvas_size, _build_file_header
+    from duck_ffmpeg import DEFAULT_X264_PRESET, VIDEO_FRAME_BATCH, X264_PRESETS, encode_rgb_video, probe_audio_duration
 
 
 # 分类名称要求
@@ -35,6 +26,8 @@ LSB_BITS_PER_CHANNEL = 2
 DUCK_CHANNELS = 3
 WATERMARK_SKIP_W_RATIO = 0.40
 WATERMARK_SKIP_H_RATIO = 0.08
+# 不超过该时长（秒）的音频视为无效，不嵌入视频（否则会被循环铺满整段视频）
+MIN_AUDIO_SECONDS = 0.05
 
 
 
@@ -54,98 +47,79 @@ def _pil_to_tensor(image: Image.Image) -> torch.Tensor:
     return torch.from_numpy(arr)[None, ...]
 
 
+def _iter_rgb24_batches(frames, batch_size: int = VIDEO_FRAME_BATCH):
+    """
+    把帧序列（(N, H, W, C) 张量 / 数组，或单帧列表）按批转成 (n, H, W, 3) uint8 数组。
+    各批复用同一块 uint8 缓冲（调用方须在取下一批前用完），浮点临时量只有单帧大小。
+    """
+    stage = None
+    for start in range(0, len(frames), batch_size):
+        chunk = frames[start:start + batch_size]
+        for j, frame in enumerate(chunk):
+            frame = torch.as_tensor(frame).detach()
+            if frame.shape[-1] > 3:
+                frame = frame[..., :3]
+            elif frame.shape[-1] == 1:
+                frame = frame.expand(*frame.shape[:-1], 3)
+            if stage is None:
+                stage = torch.empty((batch_size, *frame.shape), dtype=torch.uint8)
+            # 赋值时转换为 uint8，GPU 上的帧在设备上完成缩放与取整
+            stage[j] = (frame * 255.0).round_().clamp_(0, 255)
+        yield stage[:len(chunk)].numpy()
 
 
 # ===================== 核心：复用VideoHelperSuite的音频解析逻辑 =====================
-def export_lazy_audio_to_file(audio_obj) -> str:
-
+def _pcm_samples_first(arr: np.ndarray) -> np.ndarray:
+    """整理为 (采样数, 声道)：去掉 batch 维，单声道补出声道维，(声道, 采样数) 转置。"""
+    if arr.ndim == 3:
+        arr = arr.squeeze(0)  # 移除 batch 维度 (1, C, N) -> (C, N)
+    if arr.ndim == 1:
+        arr = arr[:, None]
+    if arr.ndim == 2 and arr.shape[0] < arr.shape[1]:
+        arr = arr.T
+    return arr
+
+
+def export_lazy_audio_to_pcm(audio_obj):
+    """
+    把各种音频输入整理成可直接交给 ffmpeg 的形式，不写临时 WAV。
+    - 带文件路径的对象或路径字符串：原样返回路径，由 ffmpeg 直接读取
+    - Tensor / ndarray / dict（ComfyUI 的 waveform + sample_rate）/ (数据, 采样率)：返回 ((采样数, 声道) 数组, 采样率)
+    无法解析时返回 None。
+    """
     path_attr = getattr(audio_obj, "file", None)
     if isinstance(path_attr, str) and os.path.exists(path_attr):
         return path_attr
 
-
-    temp_audio_path = tempfile.mkstemp(suffix=".wav")
-    # mkstemp返回(fd, path)，我们需要path，并关闭fd
-    os.close(temp_audio_path[0])
-    temp_audio_path = temp_audio_path[1]
-
     try:
-
         if isinstance(audio_obj, torch.Tensor):
-            import soundfile as sf
-            audio_np = audio_obj.detach().cpu().numpy()
-            if audio_np.ndim == 1:
-                audio_np = audio_np[:, None]
-            if audio_np.ndim == 2 and audio_np.shape[0] < audio_np.shape[1]:
-                audio_np = audio_np.T
-            sf.write(temp_audio_path, audio_np, samplerate=44100)
-            print(f"✅ 导出音频张量为WAV：{temp_audio_path}")
-            print(f"✅ Export audio tensor to WAV: {temp_audio_path}")
-            return temp_audio_path
+            return _pcm_samples_first(audio_obj.detach().cpu().numpy()), 44100
 
         elif isinstance(audio_obj, np.ndarray):
-            import soundfile as sf
-            arr = audio_obj
-            if arr.ndim == 1:
-                arr = arr[:, None]
-            if arr.ndim == 2 and arr.shape[0] < arr.shape[1]:
-                arr = arr.T
-            sf.write(temp_audio_path, arr, samplerate=44100)
-            print(f"✅ 导出numpy音频为WAV：{temp_audio_path}")
-            print(f"✅ Export numpy audio to WAV: {temp_audio_path}")
-            return temp_audio_path
+            return _pcm_samples_first(audio_obj), 44100
 
         elif isinstance(audio_obj, dict):
-            import soundfile as sf
             # 优先检查 waveform (ComfyUI 标准格式)
             data = audio_obj.get("waveform")
             if data is None:
-                data = audio_obj.get("samples") or audio_obj.get("audio")
-            
+                data = audio_obj.get("samples")
+            if data is None:
+                data = audio_obj.get("audio")
+
             sr = audio_obj.get("sample_rate") or audio_obj.get("samplerate") or 44100
-            
+
             if data is not None:
                 # 处理 Tensor 转 numpy
-                if hasattr(data, "cpu"):
-                    arr = data.detach().cpu().numpy()
-                else:
-                    arr = np.array(data)
-                
-                # 处理维度 (Batch, Channels, Samples)
-                if arr.ndim == 3:
-                    arr = arr.squeeze(0)  # 移除 batch 维度 (1, C, N) -> (C, N)
-                
-                if arr.ndim == 1:
-                    arr = arr[:, None]
-                # (Channels, Samples) -> (Samples, Channels) for soundfile
-                if arr.ndim == 2 and arr.shape[0] < arr.shape[1]:
-                    arr = arr.T
-                
-                sf.write(temp_audio_path, arr, samplerate=int(sr))
-                print(f"✅ 导出dict音频为WAV：{temp_audio_path}")
-                print(f"✅ Export dict audio to WAV: {temp_audio_path}")
-                return temp_audio_path
+                arr = data.detach().cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+                return _pcm_samples_first(arr), int(sr)
 
         elif isinstance(audio_obj, (tuple, list)) and len(audio_obj) >= 1:
-            import soundfile as sf
-            arr = np.array(audio_obj[0])
             sr = audio_obj[1] if len(audio_obj) > 1 else 44100
-            if arr.ndim == 1:
-                arr = arr[:, None]
-            if arr.ndim == 2 and arr.shape[0] < arr.shape[1]:
-                arr = arr.T
-            sf.write(temp_audio_path, arr, samplerate=int(sr))
-            print(f"✅ 导出tuple/list音频为WAV：{temp_audio_path}")
-            print(f"✅ Export tuple/list audio to WAV: {temp_audio_path}")
-            return temp_audio_path
+            return _pcm_samples_first(np.asarray(audio_obj[0])), int(sr)
 
         elif isinstance(audio_obj, str):
             if os.path.exists(audio_obj):
-                import shutil
-                shutil.copy2(audio_obj, temp_audio_path)
-                print(f"✅ 复制音频文件到临时路径：{temp_audio_path}")
-                print(f"✅ Copy audio file to temp path: {temp_audio_path}")
-                return temp_audio_path
+                return audio_obj
             raise FileNotFoundError(f"音频路径不存在：{audio_obj}")
 
         raise TypeError(f"不支持的音频类型：{type(audio_obj)}")
@@ -153,8 +127,6 @@ def export_lazy_audio_to_file(audio_obj) -> str:
     except Exception as e:
         print(f"❌ Export audio failed: {str(e)}")
         print(f"❌ 导出音频失败：{str(e)}")
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
         return None
 
 class DuckHideNode:
@@ -175,6 +147,8 @@ class DuckHideNode:
                 "images": ("IMAGE",),
                 "audio": ("AUDIO",),
                 "text_input": ("STRING", {"forceInput": True}),
+                "x264_preset": (X264_PRESETS, {"default": DEFAULT_X264_PRESET, "tooltip": "合成视频的编码速度，越快体积越大"}),
+                "ffmpeg_threads": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1, "tooltip": "合成视频的编码线程数，0 为自动"}),
             },
         }
 
@@ -183,172 +157,68 @@ class DuckHideNode:
     FUNCTION = "hide"
     CATEGORY = CATEGORY
 
-    def _convert_comfy_image_to_cv2(self, comfy_image):
-        img = np.rint(comfy_image.detach().cpu().numpy() * 255.0).astype(np.uint8)
-        if img.ndim == 4:
-            img = img.squeeze(0)
-        if img.shape[-1] == 4:
-            img = img[..., :3]
-        return img
-
-    def _parse_comfy_audio(self, audio: Any) -> str:
+    def _parse_comfy_audio(self, audio: Any):
         """
-        统一解析音频：复用保存音频节点的export逻辑
+        统一解析音频：返回音频文件路径，或 ((采样数, 声道) 数组, 采样率)
         """
-        if audio is None or audio == "":
+        if audio is None or (isinstance(audio, str) and audio == ""):
             return None
-        
-        # 核心：调用导出函数，将任意音频对象转为临时文件路径
-        audio_path = export_lazy_audio_to_file(audio)
-        return audio_path
-
-    def _images_to_video(self, images: List[Image.Image], fps: float, audio: Any) -> np.ndarray:
-        # """将多张图片合成视频"""
-        frame_list = []
-        for img in images:
-            rgb_img = self._convert_comfy_image_to_cv2(img)
-            frame_list.append(rgb_img)
-
-        clip = ImageSequenceClip(frame_list, fps=fps)
-        audio_clip = None
-        
-        # 1. 尝试加载音频
-        if audio is not None and audio != "":
+        return export_lazy_audio_to_pcm(audio)
+
+    def _images_to_video(self, images, fps: float, audio: Any,
+                         x264_preset: str = DEFAULT_X264_PRESET, ffmpeg_threads: int = 0) -> bytes:
+        """
+        将帧序列合成 MP4：按批转换为 rgb24 后直接写入 ffmpeg 管道，峰值内存只与批大小有关。
+        images 为 (N, H, W, C) 张量 / 数组或单帧列表。
+        """
+        frame_count = len(images)
+        height, width = images[0].shape[:2]
+
+        # 1. 尝试加载音频（按视频时长循环 / 截断在写入管道时完成）
+        audio_src = None
+        if audio is not None and not (isinstance(audio, str) and audio == ""):
+            print("检测到音频输入，尝试嵌入视频中")
+            print("Audio detected, attempting to embed into video")
             try:
-                print("检测到音频输入，尝试嵌入视频中")
-                print("Audio detected, attempting to embed into video")
-                audio_path = self._parse_comfy_audio(audio)
-                print("audio_path:", audio_path)
-                
-                if audio_path is not None:
-                    try:
-                        loaded_audio = AudioFileClip(audio_path)
-                        # 检查音频有效性
-                        if loaded_audio.duration <= 0.05:
-                            print(f"⚠️ Audio duration too short ({loaded_audio.duration}s), ignoring audio.")
-                            loaded_audio.close()
-                            audio_clip = None
-                        else:
-                            audio_clip = loaded_audio
-                    except Exception as e:
-                         print(f"⚠️ Failed to load AudioFileClip: {e}, ignoring audio.")
-                         audio_clip = None
-
-                    if audio_clip:
-                        # 音频处理逻辑 (循环/截断)
-                        if audio_clip.duration > clip.duration:
-                            if hasattr(audio_clip, 'subclip'):
-                                audio_clip = audio_clip.subclip(0, clip.duration)
-                            else:
-                                audio_clip = audio_clip.subclipped(0, clip.duration)
-                        else:
-                            repeats = int(clip.duration // audio_clip.duration)
-                            remainder = clip.duration - repeats * audio_clip.duration
-                            parts = []
-                            if repeats <= 0:
-                                if hasattr(audio_clip, 'subclip'):
-                                     parts.append(audio_clip.subclip(0, min(audio_clip.duration, clip.duration)))
-                                else:
-                                     parts.append(audio_clip.subclipped(0, min(audio_clip.duration, clip.duration)))
-                            else:
-                                for _ in range(repeats):
-                                    parts.append(audio_clip)
-                                if remainder > 0:
-                                    if hasattr(audio_clip, 'subclip'):
-                                        parts.append(audio_clip.subclip(0, remainder))
-                                    else:
-                                        parts.append(audio_clip.subclipped(0, remainder))
-                            audio_clip = concatenate_audioclips(parts)
-                        
-                        # 设置音频到视频剪辑
-                        if hasattr(clip, 'set_audio'):
-                             clip = clip.set_audio(audio_clip)
-                        else:
-                             clip = clip.with_audio(audio_clip)
+                audio_src = self._parse_comfy_audio(audio)
             except Exception as e:
                 print(f"⚠️ Audio processing error: {e}, continue without audio.")
-                if audio_clip:
-                    audio_clip.close()
-                audio_clip = None
-                # 移除已设置的音频
-                if hasattr(clip, 'set_audio'):
-                     clip = clip.set_audio(None)
-                else:
-                     clip = clip.with_audio(None)
-
-        # 2. 尝试写入视频文件 (带重试机制)
-        temp_video_path = None
-        try:
-            def write_video(use_audio=True):
-                # 必须 delete=False 否则 win 下无法读取
-                with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tf:
-                    t_path = tf.name
-                
-                # 如果不使用音频，强制移除
-                current_clip = clip
-                if not use_audio:
-                    if hasattr(current_clip, 'set_audio'):
-                        current_clip = current_clip.set_audio(None)
-                    else:
-                        current_clip = current_clip.with_audio(None)
-
-                current_clip.write_videofile(
-                    t_path,
-                    codec="libx264",
-                    audio_codec="aac" if use_audio and current_clip.audio else None,
-                    fps=fps,
-                    ffmpeg_params=[
-                        "-pix_fmt","yuv420p",
-                        "-crf","16",
-                        "-preset","medium",
-                        "-profile:v","high",
-                        "-movflags","+faststart"
-                    ]
-                )
-                return t_path
-
-            try:
-                # 第一次尝试：如果 audio_clip 存在，则尝试带音频写入
-                temp_video_path = write_video(use_audio=(audio_clip is not None))
-            except (IndexError, OSError, Exception) as e:
-                if audio_clip is not None:
-                    print(f"❌ Video encoding with audio failed: {e}")
-                    print("🔄 Retrying without audio...")
-                    # 清理第一次失败的临时文件 (如果有)
-                    if temp_video_path and os.path.exists(temp_video_path):
-                        try:
-                            os.unlink(temp_video_path)
-                        except:
-                            pass
-                    # 重试不带音频
-                    temp_video_path = write_video(use_audio=False)
-                else:
-                    # 如果本来就没音频还失败了，那就真失败了
-                    raise e
-
-            # 读取最终成功的临时文件
-            with open(temp_video_path, "rb") as f:
-                video_bytes = f.read()
-
-        finally:
-            # 强制释放资源
-            clip.close()
-            if audio_clip:
-                audio_clip.close()
-            
-            # 删除临时文件
-            if temp_video_path and os.path.exists(temp_video_path):
-                try:
-                    os.unlink(temp_video_path)
-                except:
-                    pass
-
-        return video_bytes
-
-    def hide(self, fps: float, password: str, title: str, compress: int, combine_video: bool, images=None, audio=None, Notes: str = "", text_input: str = ""):
-        return self._hide(fps, password, title, compress, combine_video, images, audio, Notes, text_input=text_input)
+                audio_src = None
+        if audio_src is not None:
+            # 检查音频有效性
+            if isinstance(audio_src, tuple):
+                pcm, sample_rate = audio_src
+                audio_duration = pcm.shape[0] / sample_rate if sample_rate > 0 else 0.0
+            else:
+                audio_duration = probe_audio_duration(audio_src, limit=2 * MIN_AUDIO_SECONDS)
+            if audio_duration <= MIN_AUDIO_SECONDS:
+                print(f"⚠️ Audio duration too short ({audio_duration}s), ignoring audio.")
+                audio_src = None
+
+        def encode(with_audio: bool) -> bytes:
+            return encode_rgb_video(
+                _iter_rgb24_batches(images), frame_count, width, height, fps,
+                audio=audio_src if with_audio else None,
+                preset=x264_preset, threads=ffmpeg_threads,
+            )
 
-    def _hide(self, fps: float, password: str, title: str, compress: int, combine_video: bool, images=None, audio=None, Notes: str = "", video_path="", text_input: str = ""):
+        # 2. 写入视频（音频导致失败时不带音频重试）
+        try:
+            return encode(with_audio=audio_src is not None)
+        except (RuntimeError, ValueError) as e:
+            if audio_src is None:
+                raise
+            print(f"❌ Video encoding with audio failed: {e}")
+            print("🔄 Retrying without audio...")
+            return encode(with_audio=False)
+
+    def hide(self, fps: float, password: str, title: str, compress: int, combine_video: bool, images=None, audio=None, Notes: str = "", text_input: str = "",
+             x264_preset: str = DEFAULT_X264_PRESET, ffmpeg_threads: int = 0):
+        return self._hide(fps, password, title, compress, combine_video, images, audio, Notes, text_input=text_input,
+                          x264_preset=x264_preset, ffmpeg_threads=ffmpeg_threads)
+
+    def _hide(self, fps: float, password: str, title: str, compress: int, combine_video: bool, images=None, audio=None, Notes: str = "", video_path="", text_input: str = "",
+              x264_preset: str = DEFAULT_X264_PRESET, ffmpeg_threads: int = 0):
         # 优先处理文本输入
         if text_input and text_input.strip():
             raw_bytes = text_input.encode("utf-8")
@@ -395,16 +265,10 @@ class DuckHideNode:
 
 
         if video_path:
-            # 直接使用视频文件
+            # 直接使用视频文件：原始容器字节直接嵌入，文件头记录精确长度
             with open(video_path, "rb") as f:
-                vid_bytes = f.read()
-                # 转为二进制图片，再走图片逻辑
-                bin_img = _bytes_to_binary_image(vid_bytes, width=512)
-                with io.BytesIO() as buf:
-                    bin_img.save(buf, format="PNG")
-                    raw_bytes = buf.getvalue()
-                orig_ext = os.path.splitext(video_path)[1].lower().lstrip('.')
-                ext = f"{orig_ext}.binpng"
+                raw_bytes = f.read()
+            ext = os.path.splitext(video_path)[1].lower().lstrip('.')
 
         elif not combine_video and frame_count > 1:
             print("Output as image list (输出为图片列表)")
@@ -465,15 +329,10 @@ class DuckHideNode:
             print("图片张数：",frame_count)
             print("Number of images:", frame_count)
             #合成视频
-            vid_bytes = self._images_to_video(frame_list, fps,audio)
-
-            # 转为二进制图片，再走图片逻辑
-            bin_img = _bytes_to_binary_image(vid_bytes, width=512)
-            with io.BytesIO() as buf:
-                bin_img.save(buf, format="PNG")
-                raw_bytes = buf.getvalue()
-            orig_ext = "mp4"
-            ext = f"{orig_ext}.binpng"
+            # 合成的 MP4 字节直接嵌入，不再包装成二进制图片；4 维张量直接按批切片，不经过单帧列表
+            frames = images if isinstance(images, (torch.Tensor, np.ndarray)) else frame_list
+            raw_bytes = self._images_to_video(frames, fps, audio, x264_preset=x264_preset, ffmpeg_threads=ffmpeg_threads)
+            ext = "mp4"
         else:
             pil = _tensor_to_pil(frame_list[0])
             with io.BytesIO() as buf:
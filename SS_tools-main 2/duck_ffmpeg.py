@@ -0,0 +1,425 @@
+"""
+ffmpeg 子进程封装
+- 帧数据经管道直接送入 / 读出 ffmpeg，不经过 moviepy，也不在内存里拼出整段帧列表
+- 优先使用 PATH 中的 ffmpeg，没有时使用 imageio-ffmpeg 自带的可执行文件
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+DEFAULT_X264_PRESET = "medium"
+# 每批转换并写入管道的帧数，峰值内存随批大小而非总帧数增长
+VIDEO_FRAME_BATCH = 16
+# 解码时每次从管道读入的字节数上限，按整帧取整
+VIDEO_READ_CHUNK_BYTES = 64 << 20
+# 编码时循环写入音频管道的每块最少字节数
+PCM_WRITE_CHUNK_BYTES = 1 << 20
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_exe() -> str:
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+
+@lru_cache(maxsize=1)
+def ffprobe_exe():
+    """与 ffmpeg 同目录或 PATH 中的 ffprobe；imageio-ffmpeg 不带 ffprobe，此时返回 None。"""
+    exe = ffmpeg_exe()
+    sibling = os.path.join(os.path.dirname(exe), "ffprobe" + (".exe" if exe.lower().endswith(".exe") else ""))
+    if os.path.dirname(exe) and os.path.isfile(sibling):
+        return sibling
+    return shutil.which("ffprobe")
+
+
+class VideoInfo:
+    """
+    视频流信息。
+    - width / height：ffmpeg 输出帧的尺寸（已按旋转元数据交换宽高）
+    - frame_count：取自流头部的帧数，头部没有时按视频包计数
+    - sample_rate：第一条音轨的采样率，没有音轨时为 None
+    """
+
+    __slots__ = ("width", "height", "fps", "frame_count", "sample_rate")
+
+    def __init__(self, width: int, height: int, fps: float, frame_count: int, sample_rate=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_count = frame_count
+        self.sample_rate = sample_rate
+
+    @property
+    def has_audio(self) -> bool:
+        return self.sample_rate is not None
+
+
+_VIDEO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (.*)")
+_SIZE_RE = re.compile(r"\s(\d+)x(\d+)[\s,]")
+_FPS_RE = re.compile(r"([\d.]+)(k?) (fps|tbr)")
+_AUDIO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: .*?(\d+) Hz")
+_ROTATION_RE = re.compile(r"rotation of (-?[\d.]+) degrees")
+
+
+def _header_frame_count(path: str):
+    """ffprobe 读取流头部的 nb_frames；没有 ffprobe 或头部缺失时返回 None。"""
+    exe = ffprobe_exe()
+    if not exe:
+        return None
+    proc = subprocess.run(
+        [exe, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=nb_frames",
+         "-of", "default=noprint_wrappers=1:nokey=1", path],
+        capture_output=True,
+    )
+    value = proc.stdout.decode("ascii", errors="replace").strip().splitlines()
+    if proc.returncode == 0 and value and value[0].isdigit() and int(value[0]) > 0:
+        return int(value[0])
+    return None
+
+
+def _packet_frame_count(path: str) -> int:
+    """只解复用、不解码地数出视频包个数，每个视频包对应一帧。"""
+    proc = subprocess.run(
+        [ffmpeg_exe(), "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"ffmpeg frame count failed ({proc.returncode}): {message}")
+    return sum(1 for line in proc.stdout.splitlines() if line and not line.startswith(b"#"))
+
+
+def probe_video(path: str) -> VideoInfo:
+    """读取视频尺寸、帧率、帧数和是否带音轨，不解码任何帧。"""
+    proc = subprocess.run([ffmpeg_exe(), "-hide_banner", "-i", path], capture_output=True)
+    text = proc.stderr.decode("utf-8", errors="replace")
+    stream = _VIDEO_STREAM_RE.search(text)
+    size = _SIZE_RE.search(stream.group(1)) if stream else None
+    if size is None:
+        raise ValueError(f"No video stream found in {path}. 文件中没有可读取的视频流")
+    width, height = int(size.group(1)), int(size.group(2))
+    fps = 0.0
+    for value, kilo, _ in _FPS_RE.findall(stream.group(1)):
+        fps = float(value) * (1000 if kilo else 1)
+        break
+    rotation = _ROTATION_RE.search(text[stream.end():])
+    if rotation and round(float(rotation.group(1))) % 180:
+        # ffmpeg 默认按旋转元数据输出，竖屏视频的宽高与流头部相反
+        width, height = height, width
+    frame_count = _header_frame_count(path)
+    if frame_count is None:
+        frame_count = _packet_frame_count(path)
+    audio = _AUDIO_STREAM_RE.search(text)
+    return VideoInfo(width, height, fps, frame_count, int(audio.group(1)) if audio else None)
+
+
+def probe_audio_duration(path: str, limit: float) -> float:
+    """
+    解码第一条音轨的前 limit 秒并按采样数计时，返回 min(实际时长, limit)；没有音轨或无法解码时返回 0。
+    不看容器头部记录的时长，头部有时长却没有音频包的文件同样返回 0。
+    """
+    rate = 8000
+    proc = subprocess.run(
+        [ffmpeg_exe(), "-v", "error", "-i", path, "-map", "0:a:0", "-t", f"{limit:.6f}",
+         "-ac", "1", "-ar", str(rate), "-f", "f32le", "-"],
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        return 0.0
+    return len(proc.stdout) // 4 / rate
+
+
+def frame_window_filter(start: int = 0, stop=None, stride: int = 1, size=None):
+    """
+    生成按帧号截取、抽帧和缩放的 -vf 滤镜串，不需要时返回 None。
+    - 选中 [start, stop) 内满足 (n - start) % stride == 0 的帧，n 为解码顺序的帧号
+    - size：(宽, 高)，在抽帧之后缩放，跳过的帧不会被缩放或转成 rgb24
+    """
+    filters = []
+    if start > 0 or stop is not None or stride > 1:
+        cond = [f"gte(n,{start})"]
+        if stop is not None:
+            cond.append(f"lt(n,{stop})")
+        if stride > 1:
+            cond.append(f"not(mod(n-{start},{stride}))")
+        filters.append("select='" + "*".join(cond) + "'")
+    if size is not None:
+        filters.append(f"scale={size[0]}:{size[1]}:flags=area")
+    return ",".join(filters) or None
+
+
+class RawVideoReader:
+    """
+    由一个 ffmpeg 进程同时解出视频帧和音频：视频为 rgb24，音频为双声道 float32 PCM。
+    - 迭代时按块产出 (n, height, width, 3) uint8 数组，每块都是同一块暂存缓冲的视图，调用方须在取下一块前用完
+    - 迭代结束后 audio 为 (采样数, 2) 的 float32 数组；未要求音频或没有解出音频时为 None
+    - vf：额外的视频滤镜串（见 frame_window_filter），width / height 须是滤镜输出的尺寸
+    - max_frames：最多输出的帧数，到数后 ffmpeg 自行结束视频输出
+    - audio_start / audio_duration：音频截取的起点与时长（秒），与帧窗口对应
+    音频走单独的管道，由后台线程读取，避免两路输出互相阻塞；Windows 下不能向子进程传递额外管道，
+    音频改为视频解完后再由一个 ffmpeg 进程单独解出。
+    """
+
+    def __init__(self, path: str, width: int, height: int, max_frames=None, vf=None, with_audio: bool = False,
+                 audio_start: float = 0.0, audio_duration=None, chunk_bytes: int = VIDEO_READ_CHUNK_BYTES):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.max_frames = max_frames
+        self.vf = vf
+        self.with_audio = with_audio
+        self.audio_start = audio_start
+        self.audio_duration = audio_duration
+        self.chunk_bytes = chunk_bytes
+        self.audio = None
+
+    def _audio_args(self, target: str) -> list:
+        args = ["-map", "0:a:0", "-ac", "2"]
+        if self.audio_start > 0:
+            args += ["-af", f"atrim=start={self.audio_start:.6f},asetpts=PTS-STARTPTS"]
+        if self.audio_duration is not None:
+            args += ["-t", f"{self.audio_duration:.6f}"]
+        return args + ["-f", "f32le", target]
+
+    def _video_cmd(self) -> list:
+        cmd = [ffmpeg_exe(), "-v", "error", "-i", self.path, "-map", "0:v:0"]
+        if self.vf:
+            # select 丢帧后不按原帧率补帧（ffmpeg 5.1+）
+            cmd += ["-vf", self.vf, "-fps_mode", "passthrough"]
+        if self.max_frames is not None:
+            cmd += ["-frames:v", str(self.max_frames)]
+        return cmd + ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+
+    def _read_audio_separately(self) -> None:
+        proc = subprocess.run(
+            [ffmpeg_exe(), "-v", "error", "-i", self.path] + self._audio_args("pipe:1"), capture_output=True,
+        )
+        if proc.returncode == 0 and proc.stdout:
+            self.audio = _pcm_to_array(proc.stdout)
+
+    def __iter__(self):
+        frame_bytes = self.width * self.height * 3
+        batch = max(1, self.chunk_bytes // frame_bytes)
+        if self.max_frames is not None:
+            batch = max(1, min(batch, self.max_frames))
+        stage = np.empty((batch, self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(stage).cast("B")
+        cmd = self._video_cmd()
+        inline_audio = self.with_audio and os.name != "nt"
+        audio_chunks = []
+        audio_thread = None
+        if inline_audio:
+            audio_r, audio_w = os.pipe()
+            cmd += self._audio_args(f"pipe:{audio_w}")
+        with tempfile.TemporaryFile() as err:
+            try:
+                proc = subprocess.Popen(
+                    cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=err,
+                    pass_fds=(audio_w,) if inline_audio else (),
+                )
+            except Exception:
+                if inline_audio:
+                    os.close(audio_r)
+                raise
+            finally:
+                if inline_audio:
+                    os.close(audio_w)
+            if inline_audio:
+                audio_thread = threading.Thread(
+                    target=_drain_pipe, args=(audio_r, audio_chunks), name="duck-audio-reader", daemon=True,
+                )
+                audio_thread.start()
+            done = 0
+            eof = False
+            try:
+                while not eof:
+                    filled = 0
+                    while filled < batch * frame_bytes:
+                        n = proc.stdout.readinto(view[filled:batch * frame_bytes])
+                        if not n:
+                            eof = True
+                            break
+                        filled += n
+                    frames = filled // frame_bytes
+                    if self.max_frames is not None:
+                        # -frames:v 已限制输出，这里只防止多出的帧越界
+                        frames = min(frames, self.max_frames - done)
+                    if frames > 0:
+                        done += frames
+                        yield stage[:frames]
+            finally:
+                proc.stdout.close()
+                if not eof and proc.poll() is None:
+                    # 调用方不再读取时不必等 ffmpeg 解完剩余部分
+                    proc.kill()
+                code = proc.wait()
+                if audio_thread is not None:
+                    audio_thread.join()
+            # 调用方提前停止时 GeneratorExit 已从上面抛出，走到这里说明已读到 EOF；
+            # -frames:v 截断属于正常结束（退出码 0），非零退出即使已产出部分帧也说明视频被截断
+            if code != 0:
+                err.seek(0)
+                message = err.read().decode("utf-8", errors="replace").strip()
+                raise RuntimeError(f"ffmpeg decode failed ({code}): {message}")
+        if inline_audio:
+            if audio_chunks:
+                self.audio = _pcm_to_array(b"".join(audio_chunks))
+        elif self.with_audio:
+            self._read_audio_separately()
+
+
+def _drain_pipe(fd: int, chunks: list) -> None:
+    with open(fd, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+
+def _pcm_to_array(pcm: bytes) -> np.ndarray:
+    usable = len(pcm) - len(pcm) % 8
+    return np.frombuffer(pcm, dtype=np.float32, count=usable // 4).reshape(-1, 2)
+
+
+def _write_looped_pcm(f, pcm: np.ndarray, total_samples: int) -> None:
+    """
+    把 (采样数, 声道) 的 float32 PCM 循环写满 total_samples 个采样，不在内存里拼出整段平铺后的数组。
+    短音频先平铺成约 PCM_WRITE_CHUNK_BYTES 的一块再循环写出，每次 write 都足够大。
+    """
+    reps = -(-PCM_WRITE_CHUNK_BYTES // pcm.nbytes)
+    reps = max(1, min(reps, -(-total_samples // pcm.shape[0])))
+    if reps > 1:
+        pcm = np.tile(pcm, (reps, 1))
+    data = memoryview(pcm).cast("B")
+    frame_bytes = pcm.shape[1] * 4
+    remaining = total_samples * frame_bytes
+    while remaining > 0:
+        n = min(remaining, len(data))
+        f.write(data[:n])
+        remaining -= n
+
+
+def _pcm_writer(fd: int, pcm: np.ndarray, total_samples: int) -> None:
+    with open(fd, "wb", buffering=0) as f:
+        try:
+            _write_looped_pcm(f, pcm, total_samples)
+        except BrokenPipeError:
+            # ffmpeg 提前退出，错误由视频一侧报告
+            pass
+
+
+def encode_rgb_video(batches, frame_count: int, width: int, height: int, fps: float,
+                     audio=None, preset: str = DEFAULT_X264_PRESET, threads: int = 0, crf: int = 16) -> bytes:
+    """
+    把 rgb24 帧编码为 H.264 MP4，返回文件字节。
+    - batches：依次产出 (n, height, width, 3) uint8 数组，写入 ffmpeg 标准输入后即可释放
+    - audio：可选音轨，比视频短时循环、比视频长时截断
+      - 文件路径：由 ffmpeg 直接读取
+      - (pcm, sample_rate)：pcm 为 (采样数, 声道) 数组，转为 float32 后经第二条管道送入 ffmpeg；
+        Windows 下不能向子进程传递额外管道，改为写入一个临时的裸 PCM 文件
+    - threads：x264 线程数，0 表示由 ffmpeg 自动决定
+    MP4 的 faststart 需要回写文件头，输出先写到一个临时文件再整体读回。
+    """
+    if preset not in X264_PRESETS:
+        raise ValueError(f"Unknown x264 preset: {preset}. 不支持的 x264 预设，可选 {', '.join(X264_PRESETS)}")
+    duration = frame_count / fps
+    pcm = None
+    has_audio = bool(audio)
+    if isinstance(audio, tuple):
+        pcm, sample_rate = audio
+        pcm = np.ascontiguousarray(pcm, dtype=np.float32)
+        if pcm.ndim != 2 or pcm.shape[0] == 0 or pcm.shape[1] == 0:
+            raise ValueError(f"Audio must be a non-empty (samples, channels) array, got {pcm.shape}. 音频须为非空的 (采样数, 声道) 数组")
+        sample_rate = int(sample_rate)
+        total_samples = int(np.ceil(duration * sample_rate))
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tf:
+        out_path = tf.name
+    pcm_path = None
+    pcm_r = pcm_w = None
+    cmd = [
+        ffmpeg_exe(), "-y", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0",
+    ]
+    try:
+        if pcm is not None:
+            if os.name == "nt":
+                with tempfile.NamedTemporaryFile(suffix=".f32", delete=False) as pf:
+                    pcm_path = pf.name
+                    _write_looped_pcm(pf, pcm, total_samples)
+                audio_input = pcm_path
+            else:
+                pcm_r, pcm_w = os.pipe()
+                audio_input = f"pipe:{pcm_r}"
+            cmd += ["-f", "f32le", "-ar", str(sample_rate), "-ac", str(pcm.shape[1]), "-i", audio_input]
+        elif audio:
+            cmd += ["-stream_loop", "-1", "-i", audio]
+        cmd += ["-map", "0:v:0"]
+        if has_audio:
+            cmd += ["-map", "1:a:0", "-c:a", "aac"]
+        if width % 2 or height % 2:
+            # yuv420p 要求宽高为偶数，奇数边补一行 / 一列
+            cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        cmd += [
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", str(crf), "-preset", preset,
+            "-profile:v", "high", "-threads", str(threads), "-movflags", "+faststart",
+            "-t", f"{duration:.6f}", out_path,
+        ]
+        with tempfile.TemporaryFile() as err:
+            try:
+                proc = subprocess.Popen(
+                    cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err,
+                    pass_fds=(pcm_r,) if pcm_r is not None else (),
+                )
+            finally:
+                if pcm_r is not None:
+                    os.close(pcm_r)
+            writer = None
+            if pcm_w is not None:
+                writer = threading.Thread(
+                    target=_pcm_writer, args=(pcm_w, pcm, total_samples), name="duck-audio-writer", daemon=True,
+                )
+                pcm_w = None  # 由写线程负责关闭
+                writer.start()
+            try:
+                for batch in batches:
+                    proc.stdin.write(memoryview(np.ascontiguousarray(batch)).cast("B"))
+            except BrokenPipeError:
+                # ffmpeg 提前退出，错误信息见下方 stderr
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+                code = proc.wait()
+                if writer is not None:
+                    writer.join()
+            if code != 0:
+                err.seek(0)
+                message = err.read().decode("utf-8", errors="replace").strip()
+                raise RuntimeError(f"ffmpeg encode failed ({code}): {message}")
+        with open(out_path, "rb") as f:
+            return f.read()
+    finally:
+        if pcm_w is not None:
+            os.close(pcm_w)
+        for path in (out_path, pcm_path):
+            if path:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
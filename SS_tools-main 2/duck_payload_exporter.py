@@ -1,6 +1,12 @@
 import os
 import hashlib
+import math
 import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import Optional, Tuple
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
@@ -8,12 +14,67 @@ from PIL import Image, ImageDraw, ImageFont
 WATERMARK_SKIP_W_RATIO = 0.40
 WATERMARK_SKIP_H_RATIO = 0.08
 DUCK_CHANNELS = 3
+DUCK_TEMPLATE_CACHE_BYTES = 256 * 1024 * 1024
+DUCK_TITLE_CACHE_BYTES = 16 * 1024 * 1024
 
 try:
     import folder_paths  # type: ignore
 except Exception:
     folder_paths = None
 
+# ===================== 阶段计时 =====================
+class DuckStageLog:
+    """
+    一次编解码中各阶段的累计耗时（秒）、实际使用的 LSB 位深，
+    以及模板 / 标题缓存的查找次数（缓存名 -> [命中, 未命中]），由 collect_duck_stages 填写。
+    缓存在各工作进程内各自维护，按次带回的增量才能在主进程里汇总。
+    """
+
+    __slots__ = ("timings", "lsb_depth", "cache_lookups")
+
+    def __init__(self):
+        self.timings = {}
+        self.lsb_depth = None
+        self.cache_lookups = {}
+
+
+_stage_local = threading.local()
+
+@contextmanager
+def collect_duck_stages():
+    """在当前线程内收集 duck_stage 计时，产出 DuckStageLog；未处于收集状态时各阶段不计时。"""
+    log = DuckStageLog()
+    outer = getattr(_stage_local, "log", None)
+    _stage_local.log = log
+    try:
+        yield log
+    finally:
+        _stage_local.log = outer
+
+@contextmanager
+def duck_stage(name: str):
+    """给一个阶段计时，累加到当前线程的 DuckStageLog；同名阶段多次出现时耗时相加。"""
+    log = getattr(_stage_local, "log", None)
+    if log is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log.timings[name] = log.timings.get(name, 0.0) + time.perf_counter() - start
+
+def _note_lsb_depth(k: int) -> None:
+    log = getattr(_stage_local, "log", None)
+    if log is not None:
+        log.lsb_depth = k
+
+def _note_cache_lookup(cache: str, hit: bool) -> None:
+    log = getattr(_stage_local, "log", None)
+    if log is not None:
+        counts = log.cache_lookups.setdefault(cache, [0, 0])
+        counts[0 if hit else 1] += 1
+
 def _bytes_to_binary_image(data: bytes, width: int = 512) -> Image.Image:
     """
     将任意二进制数据转为一张无损 PNG：
@@ -30,138 +91,600 @@ def _bytes_to_binary_image(data: bytes, width: int = 512) -> Image.Image:
     img = Image.fromarray(arr, mode="RGB")
     return img
 
+# 去掉末尾补零时每次向前扫描的字节数
+BINARY_IMAGE_TAIL_SCAN_BYTES = 1 << 16
 
-def _generate_key_stream(password: str, salt: bytes, length: int) -> bytes:
+def _binary_image_to_bytes(fp) -> bytes:
+    """
+    _bytes_to_binary_image 的逆过程：按 RGB 像素顺序取回字节并去掉末尾补零（与 rstrip(b"\\x00") 一致）。
+    fp 可以是路径或文件对象；只在数组上定位末尾，最后只拷贝一次有效部分。
+    """
+    with Image.open(fp) as img:
+        flat = _image_to_rgb_array(img).reshape(-1)
+    end = len(flat)
+    while end > 0:
+        start = max(0, end - BINARY_IMAGE_TAIL_SCAN_BYTES)
+        nz = np.flatnonzero(flat[start:end])
+        if len(nz):
+            end = start + int(nz[-1]) + 1
+            break
+        end = start
+    return flat[:end].tobytes()
+
+
+KEY_STREAM_BLOCK_BYTES = 1 << 20
+
+
+def _iter_key_stream(password: str, salt: bytes, length: int, block_bytes: int = KEY_STREAM_BLOCK_BYTES):
+    """
+    分块生成密钥流：sha256(password + salt.hex() + str(counter)) 依次拼接。
+    - 每次产出约 block_bytes 字节，拼接结果与逐块循环生成的逐字节一致
+    - 避免在 Python 循环里逐次 extend / str(counter).encode
+    """
     key_material = (password + salt.hex()).encode("utf-8")
-    out = bytearray()
-    counter = 0
-    while len(out) < length:
-        combined = key_material + str(counter).encode("utf-8")
-        out.extend(hashlib.sha256(combined).digest())
-        counter += 1
-    return bytes(out[:length])
-
-def _encrypt_with_password(data: bytes, password: str):
-    if not password:
-        return data, b"", b"", False
-    salt = os.urandom(16)
-    key_stream = _generate_key_stream(password, salt, len(data))
-    cipher = bytes(a ^ b for a, b in zip(data, key_stream))
-    pwd_hash = hashlib.sha256((password + salt.hex()).encode("utf-8")).digest()
-    return cipher, salt, pwd_hash, True
+    sha256 = hashlib.sha256
+    per_block = max(1, block_bytes // 32)
+    total = (length + 31) // 32
+    remaining = length
+    for start in range(0, total, per_block):
+        stop = min(start + per_block, total)
+        block = b"".join([sha256(key_material + b"%d" % counter).digest() for counter in range(start, stop)])
+        if len(block) > remaining:
+            block = block[:remaining]
+        remaining -= len(block)
+        yield block
+
+
+def _generate_key_stream(password: str, salt: bytes, length: int) -> bytes:
+    return b"".join(_iter_key_stream(password, salt, length))
+
+
+def _xor_in_place(buf, password: str, salt: bytes) -> None:
+    """用密钥流对可写缓冲区（bytearray / 可写 memoryview）原地做 XOR。"""
+    view = np.frombuffer(buf, dtype=np.uint8)
+    offset = 0
+    for block in _iter_key_stream(password, salt, len(view)):
+        end = offset + len(block)
+        np.bitwise_xor(view[offset:end], np.frombuffer(block, dtype=np.uint8), out=view[offset:end])
+        offset = end
+
+def _xor_with_key_stream(data: bytes, password: str, salt: bytes) -> bytes:
+    """用密钥流对整段数据做 XOR（加密与解密相同），返回新的 bytes。"""
+    out = bytearray(data)
+    _xor_in_place(out, password, salt)
+    return bytes(out)
+
+def _payload_source_size(src) -> int:
+    """载荷来源的剩余字节数：文件对象从当前位置算到末尾，其余按 bytes-like 处理。"""
+    if hasattr(src, "readinto"):
+        pos = src.tell()
+        end = src.seek(0, os.SEEK_END)
+        src.seek(pos)
+        return end - pos
+    return memoryview(src).nbytes
+
+def _build_framed_payload(src, password: str, ext: str = "png") -> bytearray:
+    """
+    一次分配出 长度前缀 + 文件头 + 载荷 的完整缓冲区，即嵌入 LSB 的全部字节。
+    - src 为 bytes-like 时只拷贝一次；为二进制文件对象（如上传缓冲）时直接 readinto，不经过中间 bytes
+    - 有密码时在缓冲区内原地加密
+    """
+    with duck_stage("header_build"):
+        size = _payload_source_size(src)
+        ext_bytes = ext.encode("utf-8")
+        has_pwd = bool(password)
+        header_len = 1 + (32 + 16 if has_pwd else 0) + 1 + len(ext_bytes) + 4 + size
+        buf = bytearray(4 + header_len)
+        struct.pack_into(">I", buf, 0, header_len)
+        idx = 4
+        buf[idx] = 1 if has_pwd else 0; idx += 1
+        if has_pwd:
+            salt = os.urandom(16)
+            buf[idx:idx + 32] = hashlib.sha256((password + salt.hex()).encode("utf-8")).digest(); idx += 32
+            buf[idx:idx + 16] = salt; idx += 16
+        buf[idx] = len(ext_bytes); idx += 1
+        buf[idx:idx + len(ext_bytes)] = ext_bytes; idx += len(ext_bytes)
+        struct.pack_into(">I", buf, idx, size); idx += 4
+    with memoryview(buf) as view:
+        body = view[idx:]
+        with duck_stage("header_build"):
+            if hasattr(src, "readinto"):
+                filled = 0
+                while filled < size:
+                    n = src.readinto(body[filled:])
+                    if not n:
+                        raise ValueError("Payload source ended early. 载荷读取不完整")
+                    filled += n
+            else:
+                with memoryview(src) as src_view:
+                    body[:] = src_view.cast("B")
+        if has_pwd:
+            with duck_stage("cipher"):
+                _xor_in_place(body, password, salt)
+        body.release()
+    return buf
 
 def _build_file_header(raw: bytes, password: str, ext: str = "png") -> bytes:
-    cipher, salt, pwd_hash, has_pwd = _encrypt_with_password(raw, password)
-    payload = cipher if has_pwd else raw
-    ext_bytes = ext.encode("utf-8")
-    header = bytearray()
-    header.append(1 if has_pwd else 0)
-    if has_pwd:
-        header.extend(pwd_hash)
-        header.extend(salt)
-    header.append(len(ext_bytes))
-    header.extend(ext_bytes)
-    header.extend(struct.pack(">I", len(payload)))
-    header.extend(payload)
-    return bytes(header)
-
-def _build_duck_image(size: int = 640, title: str = "") -> Image.Image:
-    bg = Image.new("RGBA", (size, size), (153, 204, 255, 255))
+    with memoryview(_build_framed_payload(raw, password, ext)) as view:
+        return bytes(view[4:])
+
+class _LRUImageCache:
+    """按字节数限额的 LRU 缓存，存放渲染好的图像（PIL 图像或只读 NumPy 数组）；命中情况记入当前的 DuckStageLog。"""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+        _note_cache_lookup(self.name, entry is not None)
+        return None if entry is None else entry[0]
+
+    def put(self, key, value, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, freed) = self._items.popitem(last=False)
+                self._bytes -= freed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+_background_cache = _LRUImageCache("background", DUCK_TEMPLATE_CACHE_BYTES)
+_title_cache = _LRUImageCache("title", DUCK_TITLE_CACHE_BYTES)
+
+
+def _image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def _make_scaled_text(text: str, target_h: int, color: tuple) -> Image.Image:
+    base_font = ImageFont.load_default()
+    tmp = Image.new("RGBA", (1, 1), (0, 0, 0, 0))
+    tmp_draw = ImageDraw.Draw(tmp)
+    bbox = tmp_draw.textbbox((0, 0), text, font=base_font)
+    w0 = max(1, bbox[2] - bbox[0])
+    h0 = max(1, bbox[3] - bbox[1])
+    pad = 2
+    img = Image.new("RGBA", (w0 + pad * 2, h0 + pad * 2), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((pad, pad), text, fill=color, font=base_font)
+    s = max(1e-6, float(target_h) / float(h0))
+    tw = max(1, int(round((w0 + pad * 2) * s)))
+    th = max(1, int(round((h0 + pad * 2) * s)))
+    return img.resize((tw, th), Image.BICUBIC)
+
+
+# 背景图形用到的全部纯色，按调色板索引作画
+_BACKGROUND_PALETTE = (
+    (153, 204, 255),  # 天空
+    (255, 223, 94),   # 身体
+    (255, 190, 60),   # 轮廓
+    (255, 200, 70),   # 翅膀
+    (255, 153, 51),   # 嘴
+    (200, 120, 30),   # 嘴轮廓
+    (0, 0, 0),        # 眼睛
+    (255, 255, 255),  # 水波
+    (240, 240, 240),  # 水波
+)
+
+def _render_duck_background(width: int, height: int) -> np.ndarray:
+    """
+    鸭子本体 + 底部版本号，只与尺寸有关；横向坐标按宽、纵向坐标按高缩放。返回可写的 (H, W, 3) 数组。
+    图形都是不透明纯色，先画在每像素 1 字节的调色板图上，再按行带查表展开成 RGB；
+    PIL 的 RGB 图每像素占 4 字节，这样大画布的峰值内存少一半以上，像素结果不变。
+    """
+    w, h = width, height
+    size = min(w, h)
+    ink = {color: i for i, color in enumerate(_BACKGROUND_PALETTE)}
+    bg = Image.new("P", (w, h), ink[(153, 204, 255)])
     draw = ImageDraw.Draw(bg)
-    body_color = (255, 223, 94)
-    beak_color = (255, 153, 51)
-    eye_color = (0, 0, 0)
-    wing_color = (255, 200, 70)
-    draw.ellipse([size * 0.2, size * 0.35, size * 0.8, size * 0.85], fill=body_color + (255,), outline=(255, 190, 60), width=4)
-    draw.ellipse([size * 0.35, size * 0.15, size * 0.65, size * 0.45], fill=body_color + (255,), outline=(255, 190, 60), width=4)
-    draw.ellipse([size * 0.4, size * 0.55, size * 0.75, size * 0.75], fill=wing_color + (255,), outline=(255, 190, 60), width=3)
-    draw.polygon([(size * 0.65, size * 0.32),(size * 0.78, size * 0.36),(size * 0.68, size * 0.40),(size * 0.60, size * 0.38)], fill=beak_color + (255,), outline=(200, 120, 30))
-    draw.ellipse([size * 0.56, size * 0.24, size * 0.60, size * 0.28], fill=eye_color + (255,))
-    draw.ellipse([size * 0.47, size * 0.24, size * 0.51, size * 0.28], fill=eye_color + (255,))
-    draw.arc([size * 0.1, size * 0.75, size * 0.9, size * 0.9], start=10, end=170, fill=(255, 255, 255, 255), width=3)
-    draw.arc([size * 0.15, size * 0.78, size * 0.85, size * 0.93], start=10, end=170, fill=(240, 240, 240, 255), width=2)
-    fs_title = max(12, int(size * 0.06))
+    body_color = ink[(255, 223, 94)]
+    beak_color = ink[(255, 153, 51)]
+    eye_color = ink[(0, 0, 0)]
+    wing_color = ink[(255, 200, 70)]
+    outline = ink[(255, 190, 60)]
+    draw.ellipse([w * 0.2, h * 0.35, w * 0.8, h * 0.85], fill=body_color, outline=outline, width=4)
+    draw.ellipse([w * 0.35, h * 0.15, w * 0.65, h * 0.45], fill=body_color, outline=outline, width=4)
+    draw.ellipse([w * 0.4, h * 0.55, w * 0.75, h * 0.75], fill=wing_color, outline=outline, width=3)
+    draw.polygon([(w * 0.65, h * 0.32),(w * 0.78, h * 0.36),(w * 0.68, h * 0.40),(w * 0.60, h * 0.38)], fill=beak_color, outline=ink[(200, 120, 30)])
+    draw.ellipse([w * 0.56, h * 0.24, w * 0.60, h * 0.28], fill=eye_color)
+    draw.ellipse([w * 0.47, h * 0.24, w * 0.51, h * 0.28], fill=eye_color)
+    draw.arc([w * 0.1, h * 0.75, w * 0.9, h * 0.9], start=10, end=170, fill=ink[(255, 255, 255)], width=3)
+    draw.arc([w * 0.15, h * 0.78, w * 0.85, h * 0.93], start=10, end=170, fill=ink[(240, 240, 240)], width=2)
+    del draw
+    arr = _palette_image_to_array(bg, _BACKGROUND_PALETTE)
+    del bg
     fs_ver_base = max(10, int(size * 0.045))
     fs_ver = max(8, int(round(fs_ver_base * 0.5)))
-    base_font = ImageFont.load_default()
-    def make_scaled_text(text: str, target_h: int, color: tuple) -> Image.Image:
-        tmp = Image.new("RGBA", (1, 1), (0, 0, 0, 0))
-        tmp_draw = ImageDraw.Draw(tmp)
-        bbox = tmp_draw.textbbox((0, 0), text, font=base_font)
-        w0 = max(1, bbox[2] - bbox[0])
-        h0 = max(1, bbox[3] - bbox[1])
-        pad = 2
-        img = Image.new("RGBA", (w0 + pad * 2, h0 + pad * 2), (0, 0, 0, 0))
-        ImageDraw.Draw(img).text((pad, pad), text, fill=color, font=base_font)
-        s = max(1e-6, float(target_h) / float(h0))
-        tw = max(1, int(round((w0 + pad * 2) * s)))
-        th = max(1, int(round((h0 + pad * 2) * s)))
-        return img.resize((tw, th), Image.BICUBIC)
-    if title:
-        title_img = make_scaled_text(title[:30], fs_title, (0, 0, 0, 255))
-        margin = int(size * 0.06)
-        tx = margin
-        ty = max(int(size * 0.10), margin)
-        if tx + title_img.width > size - margin:
-            tx = max(margin, size - margin - title_img.width)
-        if ty + title_img.height > int(size * 0.35):
-            ty = max(margin, int(size * 0.35) - title_img.height)
-        bg.paste(title_img, (tx, ty), title_img)
     ver_text = "V1.0"
-    ver_img = make_scaled_text(ver_text, fs_ver, (255, 255, 255, 255))
-    bottom_margin = int(size * 0.06)
-    vx = max(int((size - ver_img.width) // 2), 0)
-    vy = size - ver_img.height - bottom_margin
-    vy = max(vy, int(size * 0.80))
-    vy = min(vy + ver_img.height, size - ver_img.height - int(size * 0.02))
-    if vx + ver_img.width > size:
-        vx = max(0, size - ver_img.width)
-    bg.paste(ver_img, (vx, vy), ver_img)
-    return bg
+    ver_img = _make_scaled_text(ver_text, fs_ver, (255, 255, 255, 255))
+    bottom_margin = int(h * 0.06)
+    vx = max(int((w - ver_img.width) // 2), 0)
+    vy = h - ver_img.height - bottom_margin
+    vy = max(vy, int(h * 0.80))
+    vy = min(vy + ver_img.height, h - ver_img.height - int(h * 0.02))
+    if vx + ver_img.width > w:
+        vx = max(0, w - ver_img.width)
+    _paste_overlay(arr, ver_img, (vx, vy))
+    return arr
 
-def _required_canvas_size(bit_len: int, lsb_bits: int) -> int:
-    side = 640
-    while True:
-        skip_w = int(side * WATERMARK_SKIP_W_RATIO)
-        skip_h = int(side * WATERMARK_SKIP_H_RATIO)
-        excluded = skip_w * skip_h
-        usable_bits = (side * side - excluded) * DUCK_CHANNELS * lsb_bits
-        if usable_bits >= bit_len:
-            return side
-        side += 64
+# 调色板图展开为 RGB 数组时每条行带的像素数；查表时索引会被扩成 intp，行带不宜过大
+PALETTE_EXPAND_BAND_PIXELS = 1 << 20
 
-def _embed_payload_lsb(img: Image.Image, file_header: bytes, lsb_bits: int) -> Image.Image:
-    img = img.convert("RGB")
-    arr = np.array(img).astype(np.uint8)
-    h, w, c = arr.shape
+def _palette_image_to_array(img: Image.Image, palette) -> np.ndarray:
+    """按行带把调色板索引图查表展开成 (H, W, 3) 数组，额外内存只有一条行带。"""
+    w, h = img.size
+    lut = np.array(palette, dtype=np.uint8)
+    arr = np.empty((h, w, DUCK_CHANNELS), dtype=np.uint8)
+    rows = max(1, PALETTE_EXPAND_BAND_PIXELS // max(1, w))
+    for top in range(0, h, rows):
+        bottom = min(h, top + rows)
+        # mode="clip" 时 out 不经过中间缓冲；索引都在调色板范围内，不会被截断
+        np.take(lut, np.asarray(img.crop((0, top, w, bottom))), axis=0, out=arr[top:bottom], mode="clip")
+    return arr
+
+# 读取待解码图片时每条行带的像素数
+IMAGE_INGEST_BAND_PIXELS = 1 << 20
+
+def _image_to_rgb_array(img: Image.Image) -> np.ndarray:
+    """
+    把图片读成 (H, W, 3) uint8 数组，供 LSB 提取使用。
+    按行带直接写入预分配的数组：已是 RGB 的行带不经过 convert，其它模式只转换当前行带，
+    不会出现整图的转换副本、asarray 副本和 astype 副本。
+    """
+    w, h = img.size
+    arr = np.empty((h, w, DUCK_CHANNELS), dtype=np.uint8)
+    rows = max(1, IMAGE_INGEST_BAND_PIXELS // max(1, w))
+    # Image.open 只读文件头，第一次 crop 时才真正解码
+    with duck_stage("png_decode"):
+        for top in range(0, h, rows):
+            band = img.crop((0, top, w, min(h, top + rows)))
+            if band.mode != "RGB":
+                band = band.convert("RGB")
+            arr[top:top + band.height] = np.asarray(band)
+    return arr
+
+def _paste_overlay(arr: np.ndarray, overlay: Image.Image, pos: Tuple[int, int]) -> None:
+    """把带 alpha 的图层贴到 RGB 数组上，只在图层覆盖的小块区域内经过 PIL，与整图 paste 结果一致。"""
+    h, w = arr.shape[:2]
+    x, y = pos
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(w, x + overlay.width), min(h, y + overlay.height)
+    if x1 <= x0 or y1 <= y0:
+        return
+    patch = Image.fromarray(arr[y0:y1, x0:x1])
+    patch.paste(overlay, (x - x0, y - y0), overlay)
+    arr[y0:y1, x0:x1] = np.asarray(patch)
+
+
+def _render_title_overlay(width: int, height: int, title: str) -> Tuple[Image.Image, Tuple[int, int]]:
+    """标题文字图层及其左上角坐标，位于画布上部，与底部版本号不重叠。"""
+    size = min(width, height)
+    fs_title = max(12, int(size * 0.06))
+    title_img = _make_scaled_text(title, fs_title, (0, 0, 0, 255))
+    margin = int(size * 0.06)
+    tx = margin
+    ty = max(int(height * 0.10), margin)
+    if tx + title_img.width > width - margin:
+        tx = max(margin, width - margin - title_img.width)
+    if ty + title_img.height > int(height * 0.35):
+        ty = max(margin, int(height * 0.35) - title_img.height)
+    return title_img, (tx, ty)
+
+
+def _duck_background_array(width: int, height: int) -> Tuple[np.ndarray, bool]:
+    """
+    鸭子背景 RGB 数组（H, W, 3），返回 (数组, 是否为缓存共享)。共享数组只读，调用方写入前需拷贝。
+    超过缓存上限 1/4 的超大画布极少重复出现，不缓存，以免挤掉常用尺寸；此时返回的是新数组，可直接写入。
+    """
+    dims = (width, height)
+    bg = _background_cache.get(dims)
+    if bg is not None:
+        return bg, True
+    bg = _render_duck_background(width, height)
+    if bg.nbytes > _background_cache.max_bytes // 4:
+        return bg, False
+    bg.flags.writeable = False
+    _background_cache.put(dims, bg, bg.nbytes)
+    return bg, True
+
+def _title_overlay(width: int, height: int, title: str):
+    key = (width, height, title[:30])
+    overlay = _title_cache.get(key)
+    if overlay is None:
+        overlay = _render_title_overlay(width, height, title[:30])
+        _title_cache.put(key, overlay, _image_nbytes(overlay[0]))
+    return overlay
+
+def _duck_canvas_array(width: int, height: int, title: str = "") -> np.ndarray:
+    """
+    可直接写入的鸭子图 RGB 数组：背景最多拷贝一次，标题只在其覆盖的小块区域内用 PIL 贴图。
+    """
+    canvas, shared = _duck_background_array(width, height)
+    if shared:
+        canvas = canvas.copy()
+    if title:
+        title_img, pos = _title_overlay(width, height, title)
+        _paste_overlay(canvas, title_img, pos)
+    return canvas
+
+def _build_duck_image(size: int = 640, title: str = "", height: Optional[int] = None) -> Image.Image:
+    """
+    返回可直接写入的 RGB 鸭子图副本，height 为空时为 size x size 的正方形。
+    背景按尺寸、标题图层按 (尺寸, 标题) 缓存，命中时只需一次内存拷贝和一次贴图。
+    """
+    dims = (size, height or size)
+    canvas = Image.fromarray(_duck_background_array(*dims)[0])
+    if title:
+        title_img, pos = _title_overlay(*dims, title)
+        canvas.paste(title_img, pos, title_img)
+    return canvas
+
+def _watermark_skip(w: int, h: int) -> Tuple[int, int]:
     skip_w = int(w * WATERMARK_SKIP_W_RATIO)
     skip_h = int(h * WATERMARK_SKIP_H_RATIO)
-    mask2d = np.ones((h, w), dtype=bool)
-    if skip_w > 0 and skip_h > 0:
-        mask2d[:skip_h, :skip_w] = False
-    mask3d = np.repeat(mask2d[:, :, None], c, axis=2)
-    length_prefix = struct.pack(">I", len(file_header))
-    payload_with_len = length_prefix + file_header
-    bits = np.unpackbits(np.frombuffer(payload_with_len, dtype=np.uint8), bitorder="big")
+    if skip_w <= 0 or skip_h <= 0:
+        return 0, 0
+    return skip_w, skip_h
+
+MIN_CANVAS_SIDE = 640
+# 非正方形画布的长边与短边之比上限，避免为省下几个像素生成细长条
+COMPACT_CANVAS_MAX_ASPECT = 2.0
+
+def _usable_pixels(width: int, height: int) -> int:
+    skip_w, skip_h = _watermark_skip(width, height)
+    return width * height - skip_w * skip_h
+
+def _required_pixels(bit_len: int, lsb_bits: int) -> int:
+    return -(-bit_len // (DUCK_CHANNELS * lsb_bits))
+
+def _min_heights_for_widths(widths: np.ndarray, need: int) -> np.ndarray:
+    """
+    对每个宽度求可用像素不少于 need 的最小高度（不低于 MIN_CANVAS_SIDE）。
+    宽度固定时可用像素随高度严格递增，且 need / (w - skip_w * 高度比例) 向上取整的高度必然够用、
+    比它小 2 的必然不够，因此只需在这三个候选里取最小的可行值。
+    """
+    skip_w = (widths * WATERMARK_SKIP_W_RATIO).astype(np.int64)
+    per_row = widths - skip_w * WATERMARK_SKIP_H_RATIO
+    upper = np.ceil(need / per_row).astype(np.int64)
+    heights = upper
+    for delta in (1, 2):
+        cand = upper - delta
+        fits = widths * cand - skip_w * (cand * WATERMARK_SKIP_H_RATIO).astype(np.int64) >= need
+        heights = np.where(fits, cand, heights)
+    return np.maximum(heights, MIN_CANVAS_SIDE)
+
+def _required_canvas_size(bit_len: int, lsb_bits: int) -> int:
+    """可容纳 bit_len 位的最小正方形边长（不低于 MIN_CANVAS_SIDE），由面积开方直接求得再微调。"""
+    need = _required_pixels(bit_len, lsb_bits)
+    keep_ratio = 1.0 - WATERMARK_SKIP_W_RATIO * WATERMARK_SKIP_H_RATIO
+    side = max(MIN_CANVAS_SIDE, int((need / keep_ratio) ** 0.5))
+    while side > MIN_CANVAS_SIDE and _usable_pixels(side - 1, side - 1) >= need:
+        side -= 1
+    while _usable_pixels(side, side) < need:
+        side += 1
+    return side
+
+def _required_canvas_dims(bit_len: int, lsb_bits: int) -> Tuple[int, int]:
+    """
+    总像素最少的 (宽, 高)：枚举长短边之比不超过 COMPACT_CANVAS_MAX_ASPECT 的全部宽度，
+    每个宽度取最小高度，面积相同时取更接近正方形的一组。
+    """
+    need = _required_pixels(bit_len, lsb_bits)
+    side = _required_canvas_size(bit_len, lsb_bits)
+    # 面积不超过正方形时，宽度落在 [side / sqrt(A), side * sqrt(A)] 内才可能满足宽高比
+    reach = COMPACT_CANVAS_MAX_ASPECT ** 0.5
+    lo = max(MIN_CANVAS_SIDE, int(side / reach))
+    widths = np.arange(lo, int(side * reach) + 1, dtype=np.int64)
+    heights = _min_heights_for_widths(widths, need)
+    ok = (np.maximum(widths, heights) <= COMPACT_CANVAS_MAX_ASPECT * np.minimum(widths, heights))
+    widths, heights = widths[ok], heights[ok]
+    best = np.lexsort((np.abs(heights - widths), widths * heights))[0]
+    width, height = int(widths[best]), int(heights[best])
+    if width * height >= side * side:
+        return side, side
+    return width, height
+
+def _capacity_report(width: int, height: int, bit_len: int, lsb_bits: int) -> dict:
+    capacity_bits = _usable_pixels(width, height) * DUCK_CHANNELS * lsb_bits
+    wasted_bits = capacity_bits - bit_len
+    return {
+        "width": width,
+        "height": height,
+        "lsb_bits": lsb_bits,
+        "payload_bits": bit_len,
+        "capacity_bits": capacity_bits,
+        "wasted_bits": wasted_bits,
+        "wasted_ratio": wasted_bits / capacity_bits if capacity_bits else 0.0,
+    }
+
+def _carrier_views(arr: np.ndarray) -> list:
+    """
+    载体 = 去掉左上角水印矩形后的全部通道样本，按行优先顺序排列。
+    由于排除区域固定是左上角矩形，载体恰好是两块二维视图依次拼接：
+    - 顶部条带 arr[:skip_h, skip_w:]，每行 (w - skip_w) * c 个样本
+    - 其余整行 arr[skip_h:]，每行 w * c 个样本
+    返回的都是 arr 的视图（arr 需为 C 连续），不分配掩码或索引数组。
+    """
+    h, w, c = arr.shape
+    skip_w, skip_h = _watermark_skip(w, h)
+    views = []
+    if skip_h > 0 and skip_w < w:
+        views.append(arr[:skip_h, skip_w:, :].reshape(skip_h, (w - skip_w) * c))
+    views.append(arr[skip_h:].reshape(h - skip_h, w * c))
+    return views
+
+def _iter_carrier_chunks(arr: np.ndarray, count: int):
+    """按载体顺序产出覆盖前 count 个样本的视图：整行块为二维，末尾不足一行的部分为一维。"""
+    for view in _carrier_views(arr):
+        rows, row_len = view.shape
+        if count <= 0:
+            return
+        if row_len == 0:
+            continue
+        full = min(rows, count // row_len)
+        if full:
+            yield view[:full]
+            count -= full * row_len
+        if full < rows and count > 0:
+            tail = min(count, row_len)
+            yield view[full, :tail]
+            count -= tail
+
+def _carrier_capacity(arr: np.ndarray) -> int:
+    h, w, c = arr.shape
+    return _usable_pixels(w, h) * c
+
+def _carrier_samples(arr: np.ndarray, count: int) -> np.ndarray:
+    """按载体顺序拷贝出前 count 个通道样本，耗时与内存随 count 而非画布大小增长。"""
+    arr = np.ascontiguousarray(arr)
+    count = min(count, _carrier_capacity(arr))
+    out = np.empty(count, dtype=arr.dtype)
+    offset = 0
+    for view in _iter_carrier_chunks(arr, count):
+        out[offset:offset + view.size].reshape(view.shape)[...] = view
+        offset += view.size
+    return out
+
+def _pack_generic(data: np.ndarray, k: int) -> np.ndarray:
+    bits = np.unpackbits(data, bitorder="big")
     bit_len = len(bits)
-    capacity_bits = int(mask3d.sum()) * lsb_bits
-    if bit_len > capacity_bits:
-        raise ValueError("Data too large, capacity exceeded. 数据过大，鸭子图容量不够。请使用更小的文件。")
-    flat = arr.reshape(-1)
-    mask = (1 << lsb_bits) - 1
-    groups = bit_len // lsb_bits + (1 if bit_len % lsb_bits else 0)
-    pad = groups * lsb_bits - bit_len
+    groups = bit_len // k + (1 if bit_len % k else 0)
+    pad = groups * k - bit_len
     if pad:
         bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
-    bg = bits.reshape(groups, lsb_bits)
-    weights = (1 << np.arange(lsb_bits - 1, -1, -1, dtype=np.uint8))
-    vals = (bg * weights).sum(axis=1).astype(np.uint8)
-    idxs = np.flatnonzero(mask3d.reshape(-1))
-    if groups > len(idxs):
+    weights = (1 << np.arange(k - 1, -1, -1, dtype=np.uint8))
+    return (bits.reshape(groups, k) * weights).sum(axis=1).astype(np.uint8)
+
+# 每个字节值对应的 4 组 2 位（高位在前），按 uint32 存放，一次 gather 产出 4 个样本值
+_K2_TABLE = np.ascontiguousarray(
+    (np.arange(256, dtype=np.uint8)[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3
+).view(np.uint32).reshape(256)
+
+def _pack_k2(data: np.ndarray) -> np.ndarray:
+    """每字节拆成 4 组 2 位，高位在前。"""
+    return _K2_TABLE[data].view(np.uint8)
+
+def _pack_k6(data: np.ndarray) -> np.ndarray:
+    """每 3 字节拆成 4 组 6 位，末尾补零后截到 ceil(8n/6) 组。"""
+    n = len(data)
+    groups = -(-n * 8 // 6)
+    padded = data
+    if n % 3:
+        padded = np.zeros(n + 3 - n % 3, dtype=np.uint8)
+        padded[:n] = data
+    b = padded.reshape(-1, 3)
+    out = np.empty((len(b), 4), dtype=np.uint8)
+    np.right_shift(b[:, 0], 2, out=out[:, 0])
+    out[:, 1] = ((b[:, 0] & 0x03) << 4) | (b[:, 1] >> 4)
+    out[:, 2] = ((b[:, 1] & 0x0F) << 2) | (b[:, 2] >> 6)
+    np.bitwise_and(b[:, 2], 0x3F, out=out[:, 3])
+    return out.reshape(-1)[:groups]
+
+def _pack_k8(data: np.ndarray) -> np.ndarray:
+    return data
+
+_LSB_PACKERS = {2: _pack_k2, 6: _pack_k6, 8: _pack_k8}
+
+def _pack_lsb_groups(data, k: int) -> np.ndarray:
+    """把字节流（bytes-like 或 uint8 数组）按高位在前切成 k 位一组，返回每组的值（uint8）。"""
+    src = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+    packer = _LSB_PACKERS.get(k)
+    return packer(src) if packer else _pack_generic(src, k)
+
+def _unpack_generic(vals: np.ndarray, k: int, byte_count: int) -> bytes:
+    bits = np.unpackbits(vals, bitorder="big").reshape(-1, 8)[:, -k:].reshape(-1)
+    return np.packbits(bits[:byte_count * 8], bitorder="big").tobytes()
+
+def _unpack_k2(vals: np.ndarray, byte_count: int) -> bytes:
+    v = vals[:byte_count * 4].reshape(-1, 4)
+    out = v[:, 0] << 6
+    out |= v[:, 1] << 4
+    out |= v[:, 2] << 2
+    out |= v[:, 3]
+    return out.tobytes()
+
+def _unpack_k6(vals: np.ndarray, byte_count: int) -> bytes:
+    n = len(vals)
+    if n % 4:
+        padded = np.zeros(n + 4 - n % 4, dtype=np.uint8)
+        padded[:n] = vals
+        vals = padded
+    v = vals.reshape(-1, 4)
+    out = np.empty((len(v), 3), dtype=np.uint8)
+    out[:, 0] = (v[:, 0] << 2) | (v[:, 1] >> 4)
+    out[:, 1] = (v[:, 1] << 4) | (v[:, 2] >> 2)
+    out[:, 2] = (v[:, 2] << 6) | v[:, 3]
+    return out.reshape(-1)[:byte_count].tobytes()
+
+def _unpack_k8(vals: np.ndarray, byte_count: int) -> bytes:
+    return vals[:byte_count].tobytes()
+
+_LSB_UNPACKERS = {2: _unpack_k2, 6: _unpack_k6, 8: _unpack_k8}
+
+def _unpack_lsb_groups(samples: np.ndarray, k: int, byte_count: int) -> bytes:
+    """取每个样本的低 k 位按顺序拼接，返回前 byte_count 个字节。"""
+    vals = samples if k == 8 else samples & np.uint8((1 << k) - 1)
+    unpacker = _LSB_UNPACKERS.get(k)
+    return unpacker(vals, byte_count) if unpacker else _unpack_generic(vals, k, byte_count)
+
+# 嵌入时每次打包并写入的样本数，k=2 时打包结果是载荷的 4 倍，分块避免整段展开
+LSB_EMBED_CHUNK_SAMPLES = 1 << 20
+
+def _iter_embed_blocks(arr: np.ndarray, count: int):
+    """把载体前 count 个样本切成不超过 LSB_EMBED_CHUNK_SAMPLES 的整行块（仍是 arr 的视图）。"""
+    for view in _iter_carrier_chunks(arr, count):
+        if view.ndim == 1:
+            yield view
+            continue
+        rows_per_block = max(1, LSB_EMBED_CHUNK_SAMPLES // view.shape[1])
+        for start in range(0, view.shape[0], rows_per_block):
+            yield view[start:start + rows_per_block]
+
+def _embed_framed_lsb(arr: np.ndarray, framed, lsb_bits: int) -> None:
+    """
+    把 长度前缀 + 文件头 整段写入 arr（C 连续的 H x W x 3 uint8）的载体低位，原地修改。
+    按块打包：每块只展开对应的一小段字节，额外内存与载荷大小无关。
+    """
+    data = framed if isinstance(framed, np.ndarray) else np.frombuffer(framed, dtype=np.uint8)
+    groups = -(-len(data) * 8 // lsb_bits)
+    if groups > _carrier_capacity(arr):
         raise ValueError("Data too large, capacity exceeded. 数据过大，鸭子图容量不够。请使用更小的文件。")
-    sel = idxs[:groups]
-    flat[sel] = (flat[sel] & (~mask)) | vals
-    arr = flat.reshape(arr.shape)
+    keep = np.uint8(0xFF ^ ((1 << lsb_bits) - 1))
+    # 每 period_bytes 字节恰好拆成 period_samples 组，块从周期边界开始打包即可与整段打包一致
+    g = math.gcd(lsb_bits, 8)
+    period_samples, period_bytes = 8 // g, lsb_bits // g
+    offset = 0
+    for block in _iter_embed_blocks(arr, groups):
+        n = block.size
+        p0 = offset // period_samples
+        p1 = -(-(offset + n) // period_samples)
+        vals = _pack_lsb_groups(data[p0 * period_bytes:p1 * period_bytes], lsb_bits)
+        skip = offset - p0 * period_samples
+        block &= keep
+        block |= vals[skip:skip + n].reshape(block.shape)
+        offset += n
+    _fill_watermark_region(arr)
+
+def _fill_watermark_region(arr: np.ndarray) -> None:
+    """左上角水印区域不承载数据，用其右侧相邻的像素块填充。"""
+    h, w, c = arr.shape
+    skip_w, skip_h = _watermark_skip(w, h)
     if skip_w > 0 and skip_h > 0:
         src_w = max(0, arr.shape[1] - skip_w)
         if src_w > 0:
@@ -172,33 +695,193 @@ def _embed_payload_lsb(img: Image.Image, file_header: bytes, lsb_bits: int) -> I
                 reps = int(np.ceil(skip_w / max(1, src_block.shape[1])))
                 dest = np.tile(src_block, (1, reps, 1))[:, :skip_w, :]
             arr[:skip_h, :skip_w, :] = dest
+
+def _embed_payload_lsb(img: Image.Image, file_header: bytes, lsb_bits: int) -> Image.Image:
+    arr = np.array(img.convert("RGB"), dtype=np.uint8)
+    _embed_framed_lsb(arr, struct.pack(">I", len(file_header)) + file_header, lsb_bits)
     return Image.fromarray(arr, mode="RGB")
 
-def export_duck_payload(
+def _read_lsb_bytes(arr: np.ndarray, k: int, byte_count: int) -> bytes:
+    """从载体开头读取 byte_count 个字节，只拷贝所需的 ceil(8 * byte_count / k) 个样本。"""
+    return _unpack_lsb_groups(_carrier_samples(arr, -(-byte_count * 8 // k)), k, byte_count)
+
+def _extract_payload_with_k(arr: np.ndarray, k: int) -> bytes:
+    """
+    先从载体开头读 32 位长度前缀，再只读取载荷实际占用的样本。
+    """
+    capacity_bits = _carrier_capacity(arr) * k
+    if capacity_bits < 32:
+        raise ValueError("Insufficient image data. 图像数据不足")
+    with duck_stage("lsb_extract"):
+        header_len = struct.unpack(">I", _read_lsb_bytes(arr, k, 4))[0]
+        total_bits = 32 + header_len * 8
+        if header_len <= 0 or total_bits > capacity_bits:
+            raise ValueError("Payload length invalid. 载荷长度异常")
+        return _read_lsb_bytes(arr, k, 4 + header_len)[4:]
+
+def _parse_header(header: bytes, password: str):
+    idx = 0
+    if len(header) < 1:
+        raise ValueError("Header corrupted. 文件头损坏")
+    has_pwd = header[0] == 1
+    idx += 1
+    pwd_hash = b""
+    salt = b""
+    if has_pwd:
+        if len(header) < idx + 32 + 16:
+            raise ValueError("Header corrupted. 文件头损坏")
+        pwd_hash = header[idx:idx + 32]; idx += 32
+        salt = header[idx:idx + 16]; idx += 16
+    if len(header) < idx + 1:
+        raise ValueError("Header corrupted. 文件头损坏")
+    ext_len = header[idx]; idx += 1
+    if len(header) < idx + ext_len + 4:
+        raise ValueError("Header corrupted. 文件头损坏")
+    ext = header[idx:idx + ext_len].decode("utf-8", errors="ignore"); idx += ext_len
+    data_len = struct.unpack(">I", header[idx:idx + 4])[0]; idx += 4
+    data = header[idx:]
+    if len(data) != data_len:
+        raise ValueError("Data length mismatch. 数据长度不匹配")
+    if not has_pwd:
+        return data, ext
+    if not password:
+        raise ValueError("Password required. 需要密码")
+    check_hash = hashlib.sha256((password + salt.hex()).encode("utf-8")).digest()
+    if check_hash != pwd_hash:
+        raise ValueError("Wrong password. 密码错误")
+    with duck_stage("cipher"):
+        plain = _xor_with_key_stream(data, password, salt)
+    return plain, ext
+
+LSB_DEPTHS = (2, 6, 8)
+# 标志位 + 密码哈希 + 盐 + 扩展名长度 + 最长扩展名 + 数据长度
+HEADER_PROBE_BYTES = 1 + 32 + 16 + 1 + 255 + 4
+
+def _header_prefix_plausible(prefix: bytes, header_len: int) -> bool:
+    """检查文件头前缀是否自洽：标志位合法，且各字段长度之和等于长度前缀。"""
+    if not prefix or prefix[0] not in (0, 1):
+        return False
+    idx = 1 + (32 + 16 if prefix[0] == 1 else 0)
+    if len(prefix) < idx + 1:
+        return False
+    ext_len = prefix[idx]; idx += 1
+    if len(prefix) < idx + ext_len + 4:
+        return False
+    data_len = struct.unpack(">I", prefix[idx + ext_len:idx + ext_len + 4])[0]
+    return idx + ext_len + 4 + data_len == header_len
+
+def _detect_lsb_depths(arr: np.ndarray) -> list:
+    """
+    只读取载体开头几百个样本，按 LSB_DEPTHS 顺序返回长度前缀与文件头都自洽的位深。
+    通常只有一个候选，调用方据此只做一次完整提取。
+    """
+    with duck_stage("lsb_extract"):
+        return _probe_lsb_depths(arr)
+
+def _probe_lsb_depths(arr: np.ndarray) -> list:
+    capacity = _carrier_capacity(arr)
+    depths = []
+    for k in LSB_DEPTHS:
+        capacity_bits = capacity * k
+        probe_bytes = min(capacity_bits // 8, 4 + HEADER_PROBE_BYTES)
+        if probe_bytes < 4:
+            continue
+        probe = _read_lsb_bytes(arr, k, probe_bytes)
+        header_len = struct.unpack(">I", probe[:4])[0]
+        if header_len <= 0 or 32 + header_len * 8 > capacity_bits:
+            continue
+        if _header_prefix_plausible(probe[4:4 + header_len], header_len):
+            depths.append(k)
+    return depths
+
+def render_duck_payload(
     raw_bytes: bytes,
     password: str,
     ext: str,
     compress: int,
     title: str,
-    output_dir: Optional[str] = None,
-    output_name: str = "duck_payload.png",
     fixed_size: Optional[int] = None,
-) -> Tuple[str, Image.Image]:
-    file_header = _build_file_header(raw_bytes, password, ext=ext)
+    square: bool = True,
+) -> Image.Image:
+    """
+    生成嵌入了载荷的鸭子图（只在内存中，不写盘）。
+    raw_bytes 可以是 bytes-like，也可以是已定位到开头的二进制文件对象（直接读入载荷缓冲区）。
+    square=False 时使用总像素最少的非正方形画布（fixed_size 优先）。
+    容量使用情况写入返回图像的 info["duck_capacity"]。
+    """
+    framed = _build_framed_payload(raw_bytes, password, ext=ext)
     lsb_bits = 8 if compress >= 8 else (6 if compress >= 6 else 2)
-    required_size = _required_canvas_size((len(file_header) + 4) * 8, lsb_bits)
-    
+    bit_len = len(framed) * 8
+    required_size = _required_canvas_size(bit_len, lsb_bits)
+    width = height = required_size
+
     if fixed_size is not None:
         if fixed_size < required_size:
             # 如果固定尺寸小于所需尺寸，打印警告但仍使用所需尺寸以避免数据溢出
             print(f"Warning: fixed_size {fixed_size} is smaller than required {required_size}, using {required_size}")
         else:
-            required_size = fixed_size
-            
-    duck_img = _build_duck_image(size=required_size, title=title)
-    duck_img = _embed_payload_lsb(duck_img, file_header, lsb_bits)
+            width = height = fixed_size
+    elif not square:
+        width, height = _required_canvas_dims(bit_len, lsb_bits)
+
+    with duck_stage("template_render"):
+        arr = _duck_canvas_array(width, height, title)
+    with duck_stage("lsb_embed"):
+        _embed_framed_lsb(arr, framed, lsb_bits)
+    _note_lsb_depth(lsb_bits)
+    del framed
+    duck_img = Image.fromarray(arr)
+    del arr
+    duck_img.info["duck_capacity"] = _capacity_report(width, height, bit_len, lsb_bits)
+    return duck_img
+
+# PNG 编码档位：LSB 写满的载体接近不可压缩，最慢的 optimize + level 9 往往只省下很少体积
+PNG_PROFILES = {
+    "fast": {"optimize": False, "compress_level": 1, "compress_type": zlib.Z_RLE},
+    "balanced": {"optimize": False, "compress_level": 6, "compress_type": zlib.Z_DEFAULT_STRATEGY},
+    "smallest": {"optimize": True, "compress_level": 9, "compress_type": zlib.Z_DEFAULT_STRATEGY},
+}
+DEFAULT_PNG_PROFILE = "smallest"
+
+def _save_duck_png(duck_img: Image.Image, fp, png_profile: str = DEFAULT_PNG_PROFILE) -> None:
+    options = PNG_PROFILES.get(png_profile)
+    if options is None:
+        raise ValueError(f"Unknown PNG profile: {png_profile}. 未知的 PNG 编码档位，可选 {', '.join(PNG_PROFILES)}")
+    with duck_stage("png_encode"):
+        duck_img.save(fp, format="PNG", **options)
+
+def export_duck_payload_to_buffer(
+    raw_bytes: bytes,
+    password: str,
+    ext: str,
+    compress: int,
+    title: str,
+    buffer,
+    fixed_size: Optional[int] = None,
+    square: bool = True,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+) -> Image.Image:
+    """生成鸭子图并把 PNG 写入调用方提供的二进制缓冲区（如 io.BytesIO），返回鸭子图。"""
+    duck_img = render_duck_payload(raw_bytes, password, ext, compress, title, fixed_size=fixed_size, square=square)
+    _save_duck_png(duck_img, buffer, png_profile)
+    return duck_img
+
+def export_duck_payload(
+    raw_bytes: bytes,
+    password: str,
+    ext: str,
+    compress: int,
+    title: str,
+    output_dir: Optional[str] = None,
+    output_name: str = "duck_payload.png",
+    fixed_size: Optional[int] = None,
+    square: bool = True,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+) -> Tuple[str, Image.Image]:
+    """生成鸭子图并写入 output_dir/output_name，返回 (路径, 鸭子图)。"""
+    duck_img = render_duck_payload(raw_bytes, password, ext, compress, title, fixed_size=fixed_size, square=square)
     base_dir = output_dir or (folder_paths.get_output_directory() if folder_paths else os.getcwd())
     os.makedirs(base_dir, exist_ok=True)
     out_path = os.path.join(base_dir, output_name)
-    duck_img.save(out_path, format="PNG", optimize=True, compress_level=9)
+    _save_duck_png(duck_img, out_path, png_profile)
     return out_path, duck_img
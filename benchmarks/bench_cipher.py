@@ -0,0 +1,68 @@
+"""
+密钥流 / XOR 加解密吞吐基准（MB/s）
+
+用法：python benchmarks/bench_cipher.py [--sizes 1,16,64] [--repeat 3]
+- legacy：原先逐字节 zip XOR + 逐块拼接密钥流
+- batched：分块密钥流 + NumPy XOR
+同时校验两条路径输出逐字节一致。
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SS_tools-main'))
+from duck_payload_exporter import _xor_with_key_stream
+
+
+def _legacy_key_stream(password: str, salt: bytes, length: int) -> bytes:
+    key_material = (password + salt.hex()).encode("utf-8")
+    out = bytearray()
+    counter = 0
+    while len(out) < length:
+        out.extend(hashlib.sha256(key_material + str(counter).encode("utf-8")).digest())
+        counter += 1
+    return bytes(out[:length])
+
+
+def _legacy_xor(data: bytes, password: str, salt: bytes) -> bytes:
+    ks = _legacy_key_stream(password, salt, len(data))
+    return bytes(a ^ b for a, b in zip(data, ks))
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,16,64", help="载荷大小（MB），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy-above", type=int, default=16, help="超过该大小（MB）不跑 legacy")
+    args = parser.parse_args()
+
+    password = "benchmark"
+    salt = os.urandom(16)
+    print(f"{'size':>8} {'path':>8} {'encrypt MB/s':>14} {'decrypt MB/s':>14}")
+    for mb in (int(x) for x in args.sizes.split(",")):
+        data = os.urandom(mb * 1024 * 1024)
+        cipher = _xor_with_key_stream(data, password, salt)
+        assert _xor_with_key_stream(cipher, password, salt) == data
+        paths = [("batched", _xor_with_key_stream)]
+        if mb <= args.skip_legacy_above:
+            assert _legacy_xor(data, password, salt) == cipher, "batched output differs from legacy"
+            paths.insert(0, ("legacy", _legacy_xor))
+        for name, fn in paths:
+            enc = _best_of(lambda: fn(data, password, salt), args.repeat)
+            dec = _best_of(lambda: fn(cipher, password, salt), args.repeat)
+            print(f"{mb:>6}MB {name:>8} {mb / enc:>14.1f} {mb / dec:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
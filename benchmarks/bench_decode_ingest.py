@@ -0,0 +1,103 @@
+"""
+解码时读入鸭子图的峰值内存：旧写法 np.array(img.convert("RGB")).astype(np.uint8) vs _image_to_rgb_array
+
+- 每个组合在独立子进程中运行，统计读入（及完整解码）期间 VmHWM 相对读入前 VmRSS 的增量
+- 鸭子图按给定分辨率生成，嵌入一段随机载荷，保存为 PNG 后再读回
+- 仅支持 Linux（读取 /proc/self/status，写 /proc/self/clear_refs 重置峰值）
+
+用法：python benchmarks/bench_decode_ingest.py [--sizes 3840x2160,7680x4320] [--payload-mb 4] [--compress 2]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SS_tools-main'))
+from duck_payload_exporter import (
+    _build_framed_payload,
+    _detect_lsb_depths,
+    _duck_canvas_array,
+    _embed_framed_lsb,
+    _extract_payload_with_k,
+    _image_to_rgb_array,
+    _parse_header,
+)
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} not available")
+
+
+def _reset_peak() -> None:
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _ingest(path: str, method: str) -> np.ndarray:
+    img = Image.open(path)
+    if method == "legacy":
+        return np.array(img.convert("RGB")).astype(np.uint8)
+    with img:
+        return _image_to_rgb_array(img)
+
+
+def _child(path: str, method: str, full: bool) -> None:
+    base = _status_mb("VmRSS")
+    _reset_peak()
+    arr = _ingest(path, method)
+    if full:
+        k = _detect_lsb_depths(arr)[0]
+        raw, _ = _parse_header(_extract_payload_with_k(arr, k), "")
+        del raw
+    print(f"{_status_mb('VmHWM') - base:.1f}")
+
+
+def _make_duck(path: str, width: int, height: int, payload_mb: int, k: int) -> None:
+    arr = _duck_canvas_array(width, height, "bench")
+    if not arr.flags.writeable:
+        arr = arr.copy()
+    framed = _build_framed_payload(os.urandom(payload_mb << 20), "", ext="bin")
+    _embed_framed_lsb(arr, framed, k)
+    Image.fromarray(arr).save(path, compress_level=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="3840x2160,7680x4320", help="画布尺寸 WxH，逗号分隔")
+    parser.add_argument("--payload-mb", type=int, default=4, help="嵌入的随机载荷大小（MB）")
+    parser.add_argument("--compress", type=int, default=2, help="LSB 位深")
+    parser.add_argument("--child", nargs=3, metavar=("PATH", "METHOD", "FULL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        path, method, full = args.child
+        _child(path, method, full == "1")
+        return
+
+    print(f"{'canvas':>10} {'method':>8} {'ingest MB':>10} {'decode MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes.split(","):
+            width, height = (int(x) for x in size.split("x"))
+            path = os.path.join(tmp, f"duck_{size}.png")
+            _make_duck(path, width, height, args.payload_mb, args.compress)
+            for method in ("legacy", "banded"):
+                peaks = []
+                for full in ("0", "1"):
+                    out = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--child", path, method, full],
+                        check=True, capture_output=True, text=True,
+                    ).stdout
+                    peaks.append(float(out))
+                print(f"{size:>10} {method:>8} {peaks[0]:>10.1f} {peaks[1]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
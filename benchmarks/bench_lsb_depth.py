@@ -0,0 +1,99 @@
+"""
+LSB 位深探测基准：逐个试解 k=2,6,8 vs 先探测再提取一次
+
+用法：python benchmarks/bench_lsb_depth.py [--payload-kb 2048] [--repeat 3]
+- legacy：原先的整图掩码提取，按 2/6/8 依次试解
+- trial：当前提取器，按 2/6/8 依次试解
+- detect：_detect_lsb_depths 探测后只提取一次
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SS_tools-main'))
+from duck_payload_exporter import (
+    WATERMARK_SKIP_H_RATIO,
+    WATERMARK_SKIP_W_RATIO,
+    _build_duck_image,
+    _build_file_header,
+    _detect_lsb_depths,
+    _embed_payload_lsb,
+    _extract_payload_with_k,
+    _parse_header,
+    _required_canvas_size,
+)
+
+
+def _legacy_extract(arr: np.ndarray, k: int) -> bytes:
+    h, w, c = arr.shape
+    skip_w = int(w * WATERMARK_SKIP_W_RATIO)
+    skip_h = int(h * WATERMARK_SKIP_H_RATIO)
+    mask2d = np.ones((h, w), dtype=bool)
+    if skip_w > 0 and skip_h > 0:
+        mask2d[:skip_h, :skip_w] = False
+    mask3d = np.repeat(mask2d[:, :, None], c, axis=2)
+    flat = arr.reshape(-1)
+    idxs = np.flatnonzero(mask3d.reshape(-1))
+    vals = (flat[idxs] & ((1 << k) - 1)).astype(np.uint8)
+    bits = np.unpackbits(vals, bitorder="big").reshape(-1, 8)[:, -k:].reshape(-1)
+    if len(bits) < 32:
+        raise ValueError("Insufficient image data. 图像数据不足")
+    header_len = struct.unpack(">I", np.packbits(bits[:32], bitorder="big").tobytes())[0]
+    if header_len <= 0 or 32 + header_len * 8 > len(bits):
+        raise ValueError("Payload length invalid. 载荷长度异常")
+    return np.packbits(bits[32:32 + header_len * 8], bitorder="big").tobytes()
+
+
+def _trial_decode(arr: np.ndarray, extract) -> tuple:
+    last_err = None
+    for k in (2, 6, 8):
+        try:
+            return _parse_header(extract(arr, k), "")
+        except Exception as e:
+            last_err = e
+    raise last_err
+
+
+def _detect_decode(arr: np.ndarray) -> tuple:
+    for k in _detect_lsb_depths(arr):
+        return _parse_header(_extract_payload_with_k(arr, k), "")
+    raise ValueError("No valid payload found. 未找到有效载荷")
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload-kb", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = os.urandom(args.payload_kb * 1024)
+    print(f"{'k':>3} {'canvas':>10} {'legacy ms':>10} {'trial ms':>10} {'detect ms':>10}")
+    for k in (2, 6, 8):
+        file_header = _build_file_header(raw, "", ext="bin")
+        size = _required_canvas_size((len(file_header) + 4) * 8, k)
+        arr = np.array(_embed_payload_lsb(_build_duck_image(size=size), file_header, k))
+        expected = (raw, "bin")
+        assert _trial_decode(arr, _legacy_extract) == expected
+        assert _trial_decode(arr, _extract_payload_with_k) == expected
+        assert _detect_decode(arr) == expected
+        legacy = _best_of(lambda: _trial_decode(arr, _legacy_extract), args.repeat)
+        trial = _best_of(lambda: _trial_decode(arr, _extract_payload_with_k), args.repeat)
+        detect = _best_of(lambda: _detect_decode(arr), args.repeat)
+        print(f"{k:>3} {size:>4}x{size:<5} {legacy * 1e3:>10.1f} {trial * 1e3:>10.1f} {detect * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
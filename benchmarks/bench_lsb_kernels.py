@@ -0,0 +1,61 @@
+"""
+LSB 按位深打包 / 解包内核吞吐基准（MB/s）
+
+用法：python benchmarks/bench_lsb_kernels.py [--sizes 1,16,64] [--repeat 3]
+- generic：unpackbits + 按权重求和 / packbits 的通用路径
+- kernel：k=2 移位掩码、k=6 三字节转四组、k=8 直接拷贝
+同时校验两条路径输出逐位一致。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SS_tools-main'))
+from duck_payload_exporter import (
+    _LSB_PACKERS,
+    _LSB_UNPACKERS,
+    _pack_generic,
+    _unpack_generic,
+)
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,16,64", help="载荷大小（MB），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'k':>3} {'pack generic':>13} {'pack kernel':>12} {'unpack generic':>15} {'unpack kernel':>14}")
+    for mb in (int(x) for x in args.sizes.split(",")):
+        n = mb * 1024 * 1024 + 1
+        data = np.frombuffer(os.urandom(n), dtype=np.uint8)
+        for k in (2, 6, 8):
+            pack, unpack = _LSB_PACKERS[k], _LSB_UNPACKERS[k]
+            vals = pack(data)
+            assert np.array_equal(vals, _pack_generic(data, k)), f"k={k} pack mismatch"
+            samples = vals | np.uint8(0xFF ^ ((1 << k) - 1)) if k < 8 else vals
+            masked = samples & np.uint8((1 << k) - 1)
+            assert unpack(masked, n) == _unpack_generic(masked, k, n) == data.tobytes(), f"k={k} unpack mismatch"
+            row = [
+                _best_of(lambda: _pack_generic(data, k), args.repeat),
+                _best_of(lambda: pack(data), args.repeat),
+                _best_of(lambda: _unpack_generic(masked, k, n), args.repeat),
+                _best_of(lambda: unpack(masked, n), args.repeat),
+            ]
+            print(f"{mb:>6}MB {k:>3} " + " ".join(f"{mb / t:>{w}.0f}" for t, w in zip(row, (13, 12, 15, 14))))
+
+
+if __name__ == "__main__":
+    main()
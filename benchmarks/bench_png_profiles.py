@@ -0,0 +1,41 @@
+"""
+鸭子图 PNG 编码档位基准：各档位在不同载荷大小与 LSB 位深下的编码耗时与输出体积
+
+用法：python benchmarks/bench_png_profiles.py [--payload-kb 64,1024,8192] [--repeat 2]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SS_tools-main'))
+from duck_payload_exporter import PNG_PROFILES, _save_duck_png, render_duck_payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload-kb", default="64,1024,8192", help="载荷大小（KB），逗号分隔")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'payload':>9} {'k':>3} {'canvas':>11} {'profile':>9} {'encode ms':>10} {'size KB':>9} {'vs raw':>7}")
+    for kb in (int(x) for x in args.payload_kb.split(",")):
+        raw = os.urandom(kb * 1024)
+        for k in (2, 6, 8):
+            duck_img = render_duck_payload(raw, "", "bin", k, "bench")
+            raw_kb = duck_img.width * duck_img.height * 3 / 1024
+            canvas = f"{duck_img.width}x{duck_img.height}"
+            for profile in PNG_PROFILES:
+                best = float("inf")
+                for _ in range(args.repeat):
+                    buf = io.BytesIO()
+                    t0 = time.perf_counter()
+                    _save_duck_png(duck_img, buf, profile)
+                    best = min(best, time.perf_counter() - t0)
+                size_kb = len(buf.getvalue()) / 1024
+                print(f"{kb:>7}KB {k:>3} {canvas:>11} {profile:>9} {best * 1e3:>10.1f} {size_kb:>9.0f} {size_kb / raw_kb:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+/api/encode 单次请求的峰值内存：在独立的服务进程中处理一次上传，统计该请求使前后 VmHWM（峰值 RSS）增长了多少
+
+对比两种上传读法，编码部分相同：
+- spool：当前服务，上传边接收边写入磁盘缓冲，编码时从文件读入嵌入缓冲区
+- read：原先的读法，Flask 默认表单解析后 file.read() 整份读成 bytes 再编码
+
+- 服务进程以 DUCK_WORKERS=0 运行，编码在请求线程内完成，峰值内存全部落在同一进程
+- 编码去重缓存关闭，每次都走完整流程
+- 客户端从磁盘文件流式发送 multipart 请求体，不计入服务进程内存
+- 仅支持 Linux（读取 /proc/<pid>/status）
+
+用法：python benchmarks/bench_upload_memory.py [--sizes-mb 10,50] [--compress 2,8] [--password pw] [--modes spool,read]
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+WEB_BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_backend')
+
+_SERVER = """
+import sys
+sys.path.insert(0, {backend!r})
+import app as A
+from werkzeug.serving import make_server
+srv = make_server('127.0.0.1', 0, A.app, threaded=True)
+print(srv.server_port, flush=True)
+srv.serve_forever()
+"""
+
+_BASELINE_SERVER = """
+import os, sys
+sys.path.insert(0, {backend!r})
+sys.path.insert(0, os.path.join({backend!r}, '..', 'SS_tools-main'))
+from flask import Flask, request
+from duck_worker import encode_payload
+from werkzeug.serving import make_server
+app = Flask(__name__)
+
+@app.route('/api/encode', methods=['POST'])
+def encode():
+    raw = request.files['file'].read()
+    png, _ = encode_payload(raw, 'mp4', request.form.get('password', ''), request.form.get('title', ''),
+                            int(request.form.get('compress', 2)), png_profile='fast')
+    return png
+
+srv = make_server('127.0.0.1', 0, app, threaded=True)
+print(srv.server_port, flush=True)
+srv.serve_forever()
+"""
+
+SERVERS = {"spool": _SERVER, "read": _BASELINE_SERVER}
+
+
+def _peak_rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmHWM not available")
+
+
+def _post_encode(port: int, path: str, size: int, fields: dict) -> int:
+    """把磁盘上的文件包成 multipart 请求体流式发送，返回响应体字节数。"""
+    boundary = uuid.uuid4().hex
+    head = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+        for k, v in fields.items()
+    )
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="payload.mp4"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+
+    def body():
+        yield head
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                yield chunk
+        yield tail
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    conn.request("POST", "/api/encode", body=body(), headers={
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    })
+    resp = conn.getresponse()
+    data = resp.read()
+    conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f"encode failed: {resp.status} {data[:200]!r}")
+    return len(data)
+
+
+def _measure(source: str, env: dict, warmup: str, path: str, size: int, fields: dict) -> float:
+    """启动一个服务进程，先用小文件预热，再上传一次，返回峰值 RSS 的增长（MB）。"""
+    server = subprocess.Popen(
+        [sys.executable, "-c", source.format(backend=WEB_BACKEND)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        port = int(server.stdout.readline())
+        _post_encode(port, warmup, 4096, fields)
+        before = _peak_rss_kb(server.pid)
+        _post_encode(port, path, size, fields)
+        return (_peak_rss_kb(server.pid) - before) / 1024
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", default="10,50", help="上传大小（MB），逗号分隔")
+    parser.add_argument("--compress", default="2,8", help="LSB 位深，逗号分隔")
+    parser.add_argument("--password", default="", help="非空时走加密路径")
+    parser.add_argument("--modes", default="spool,read", help=f"上传读法，逗号分隔：{', '.join(SERVERS)}")
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+    for mode in modes:
+        if mode not in SERVERS:
+            parser.error(f"unknown mode: {mode}")
+
+    env = dict(os.environ, DUCK_WORKERS="0", DUCK_ENCODE_CACHE_BYTES="0", DUCK_PNG_PROFILE="fast")
+    print(f"{'upload':>8} {'k':>3} " + " ".join(f"{m + ' MB':>10} {'x upload':>9}" for m in modes))
+    with tempfile.TemporaryDirectory() as tmp:
+        small = os.path.join(tmp, "warmup.bin")
+        with open(small, "wb") as f:
+            f.write(os.urandom(4096))
+        for mb in (int(x) for x in args.sizes_mb.split(",")):
+            path = os.path.join(tmp, f"{mb}.bin")
+            with open(path, "wb") as f:
+                for _ in range(mb):
+                    f.write(os.urandom(1 << 20))
+            size = mb << 20
+            for k in (int(x) for x in args.compress.split(",")):
+                fields = {"compress": k, "password": args.password, "title": "bench"}
+                deltas = [_measure(SERVERS[m], env, small, path, size, fields) for m in modes]
+                print(f"{mb:>6}MB {k:>3} " + " ".join(f"{d:>10.1f} {d / mb:>9.2f}" for d in deltas))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,110 +5,285 @@
 import os
 import io
 import tempfile
-from flask import Flask, request, jsonify, send_file, render_template
+import time
+from flask import Flask, Response, g, request, jsonify, send_file, render_template, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import numpy as np
-from PIL import Image
-
-# 导入核心编解码逻辑（直接复制核心函数，避免依赖 torch）
-import struct
-import hashlib
-
-WATERMARK_SKIP_W_RATIO = 0.40
-WATERMARK_SKIP_H_RATIO = 0.08
-
-def _extract_payload_with_k(arr: np.ndarray, k: int) -> bytes:
-    h, w, c = arr.shape
-    skip_w = int(w * WATERMARK_SKIP_W_RATIO)
-    skip_h = int(h * WATERMARK_SKIP_H_RATIO)
-    mask2d = np.ones((h, w), dtype=bool)
-    if skip_w > 0 and skip_h > 0:
-        mask2d[:skip_h, :skip_w] = False
-    mask3d = np.repeat(mask2d[:, :, None], c, axis=2)
-    flat = arr.reshape(-1)
-    idxs = np.flatnonzero(mask3d.reshape(-1))
-    vals = (flat[idxs] & ((1 << k) - 1)).astype(np.uint8)
-    ub = np.unpackbits(vals, bitorder="big").reshape(-1, 8)[:, -k:]
-    bits = ub.reshape(-1)
-    if len(bits) < 32:
-        raise ValueError("Insufficient image data. 图像数据不足")
-    len_bits = bits[:32]
-    length_bytes = np.packbits(len_bits, bitorder="big").tobytes()
-    header_len = struct.unpack(">I", length_bytes)[0]
-    total_bits = 32 + header_len * 8
-    if header_len <= 0 or total_bits > len(bits):
-        raise ValueError("Payload length invalid. 载荷长度异常")
-    payload_bits = bits[32:32 + header_len * 8]
-    return np.packbits(payload_bits, bitorder="big").tobytes()
-
-def _generate_key_stream(password: str, salt: bytes, length: int) -> bytes:
-    key_material = (password + salt.hex()).encode("utf-8")
-    out = bytearray()
-    counter = 0
-    while len(out) < length:
-        out.extend(hashlib.sha256(key_material + str(counter).encode("utf-8")).digest())
-        counter += 1
-    return bytes(out[:length])
-
-def _parse_header(header: bytes, password: str):
-    idx = 0
-    if len(header) < 1:
-        raise ValueError("Header corrupted. 文件头损坏")
-    has_pwd = header[0] == 1
-    idx += 1
-    pwd_hash = b""
-    salt = b""
-    if has_pwd:
-        if len(header) < idx + 32 + 16:
-            raise ValueError("Header corrupted. 文件头损坏")
-        pwd_hash = header[idx:idx + 32]; idx += 32
-        salt = header[idx:idx + 16]; idx += 16
-    if len(header) < idx + 1:
-        raise ValueError("Header corrupted. 文件头损坏")
-    ext_len = header[idx]; idx += 1
-    if len(header) < idx + ext_len + 4:
-        raise ValueError("Header corrupted. 文件头损坏")
-    ext = header[idx:idx + ext_len].decode("utf-8", errors="ignore"); idx += ext_len
-    data_len = struct.unpack(">I", header[idx:idx + 4])[0]; idx += 4
-    data = header[idx:]
-    if len(data) != data_len:
-        raise ValueError("Data length mismatch. 数据长度不匹配")
-    if not has_pwd:
-        return data, ext
-    if not password:
-        raise ValueError("Password required. 需要密码")
-    check_hash = hashlib.sha256((password + salt.hex()).encode("utf-8")).digest()
-    if check_hash != pwd_hash:
-        raise ValueError("Wrong password. 密码错误")
-    ks = _generate_key_stream(password, salt, len(data))
-    plain = bytes(a ^ b for a, b in zip(data, ks))
-    return plain, ext
-
-# 导入编码逻辑
+
+# 导入编解码核心逻辑（不依赖 torch）
 import sys
 import os
 # 添加 SS_tools-main 到 Python 路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SS_tools-main'))
-from duck_payload_exporter import export_duck_payload, _bytes_to_binary_image
+from duck_payload_exporter import PNG_PROFILES
+from duck_worker import DuckWorkerPool, PoolBusy
+from duck_jobs import DuckJobStore, JOB_DONE, JOB_FAILED
+from duck_batch import stream_batch_zip
+from duck_upload import DuckRequest
+from duck_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, DuckMetrics
+from duck_profile import DuckProfiler
+from duck_cache import (
+    decode_cache_from_env, decode_cache_key, pack_decode_result, unpack_decode_result,
+    encode_cache_from_env, encode_cache_key, pack_encode_result, unpack_encode_result,
+)
 
 app = Flask(__name__)
-CORS(app)  # 允许跨域请求
+# 上传文件边接收边写入磁盘缓冲并计算哈希，见 duck_upload.py
+app.request_class = DuckRequest
+CORS(app, expose_headers=['X-Duck-Canvas', 'X-Duck-Wasted-Bits', 'X-Duck-Cache'])  # 允许跨域请求
 
 # 配置
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB 最大上传
+DuckRequest.max_file_bytes = int(os.environ.get('DUCK_MAX_FILE_BYTES', app.config['MAX_CONTENT_LENGTH']))  # 单个文件上限
 app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
 
+# 鸭子图 PNG 编码档位默认值：fast / balanced / smallest，可被请求参数 png_profile 覆盖
+# Web 端默认 fast（导出脚本默认 smallest）：LSB 写满的载体几乎不可压缩，smallest 慢得多却只小一点
+DEFAULT_PNG_PROFILE = os.environ.get('DUCK_PNG_PROFILE', 'fast')
+if DEFAULT_PNG_PROFILE not in PNG_PROFILES:
+    raise ValueError(f"Invalid DUCK_PNG_PROFILE: {DEFAULT_PNG_PROFILE}. 无效的 DUCK_PNG_PROFILE，可选 {', '.join(PNG_PROFILES)}")
+
+# 进程内指标，/api/metrics 输出
+metrics = DuckMetrics()
+
+# 编解码进程池：DUCK_WORKERS / DUCK_QUEUE_DEPTH / DUCK_RETRY_AFTER；各阶段耗时汇总到 metrics
+worker_pool = DuckWorkerPool.from_env(on_stages=metrics.observe_stages)
+
+def _decode_with_cache(png_bytes, password, wait=False, inline=False):
+    """
+    先查解码缓存，未命中再交给进程池；只缓存成功的结果，密码错误等异常直接抛出。
+    返回 (原始字节, 扩展名, 是否命中)
+    """
+    key = decode_cache_key(png_bytes, password)
+    blob = decode_cache.get(key)
+    if blob is not None:
+        raw, ext = unpack_decode_result(blob)
+        metrics.payload_bytes.observe(len(raw), op='decode')
+        return raw, ext, True
+    raw, ext = worker_pool.decode(png_bytes, password, wait=wait, inline=inline)
+    decode_cache.put(key, pack_decode_result(raw, ext))
+    metrics.payload_bytes.observe(len(raw), op='decode')
+    return raw, ext, False
+
+def _job_decode(png_bytes, password, wait=False):
+    raw, ext, _ = _decode_with_cache(png_bytes, password, wait=wait)
+    return raw, ext
+
+def _encode_with_cache(raw_bytes, ext, password, title, compress, square, png_profile, wait=False, inline=False):
+    """
+    无密码时输出是确定的，先查去重缓存；有密码时每次使用新盐，直接交给进程池。
+    返回 (PNG 字节, 容量报告, 是否命中)
+    """
+    # 上传缓冲在接收时已记下大小；bytes-like 直接取长度
+    size = getattr(raw_bytes, 'size', None)
+    metrics.payload_bytes.observe(len(raw_bytes) if size is None else size, op='encode')
+    if password:
+        png_bytes, capacity = worker_pool.encode(
+            raw_bytes, ext, password, title, compress, square=square, png_profile=png_profile,
+            wait=wait, inline=inline,
+        )
+        return png_bytes, capacity, False
+    key = encode_cache_key(raw_bytes, ext, title, compress, square, png_profile)
+    blob = encode_cache.get(key)
+    if blob is not None:
+        png_bytes, capacity = unpack_encode_result(blob)
+        return png_bytes, capacity, True
+    png_bytes, capacity = worker_pool.encode(
+        raw_bytes, ext, password, title, compress, square=square, png_profile=png_profile,
+        wait=wait, inline=inline,
+    )
+    encode_cache.put(key, pack_encode_result(png_bytes, capacity))
+    return png_bytes, capacity, False
+
+def _job_encode(raw_bytes, ext, password, title, compress, square=True, png_profile=DEFAULT_PNG_PROFILE, wait=False):
+    png_bytes, capacity, _ = _encode_with_cache(raw_bytes, ext, password, title, compress, square, png_profile, wait=wait)
+    return png_bytes, capacity
+
+def _cache_stat(field):
+    caches = (('decode', decode_cache), ('encode', encode_cache))
+    return lambda: [((name,), cache.stats()[field]) for name, cache in caches]
+
+def _init_services():
+    """
+    创建磁盘缓存、异步任务表与剖析器，并登记依赖它们的指标。
+    spawn 启动的工作进程会以 __mp_main__ 重新执行本文件，它们只用到 duck_worker 与导出器，不调用这里。
+    """
+    global decode_cache, encode_cache, job_store, profiler
+    # 解码结果磁盘缓存：DUCK_DECODE_CACHE_DIR / DUCK_DECODE_CACHE_BYTES（0 关闭）/ DUCK_DECODE_CACHE_TTL
+    decode_cache = decode_cache_from_env()
+    # 无密码编码去重缓存：DUCK_ENCODE_CACHE_DIR / DUCK_ENCODE_CACHE_BYTES（0 关闭）/ DUCK_ENCODE_CACHE_TTL
+    encode_cache = encode_cache_from_env()
+    # 异步任务：DUCK_JOB_RUNNERS / DUCK_JOB_MAX / DUCK_JOB_TTL / DUCK_JOB_MAX_BYTES
+    job_store = DuckJobStore.from_env(worker_pool, encode_fn=_job_encode, decode_fn=_job_decode)
+    # 按请求开启的性能剖析：DUCK_PROFILE_TOKEN（为空关闭）/ DUCK_PROFILE_DIR / DUCK_PROFILE_MAX_FILES
+    profiler = DuckProfiler.from_env()
+
+    metrics.add_collected('duck_pool_in_flight', 'Encodes and decodes running or queued in the worker pool.',
+                          'gauge', (), lambda: [((), worker_pool.in_flight)])
+    metrics.add_collected('duck_jobs', 'Async jobs currently held, by status.',
+                          'gauge', ('status',), lambda: [((k,), v) for k, v in job_store.counts().items()])
+    metrics.add_collected('duck_cache_hits_total', 'Disk cache hits.', 'counter', ('cache',), _cache_stat('hits'))
+    metrics.add_collected('duck_cache_misses_total', 'Disk cache misses.', 'counter', ('cache',), _cache_stat('misses'))
+    metrics.add_collected('duck_cache_evictions_total', 'Disk cache evictions.', 'counter', ('cache',), _cache_stat('evictions'))
+    metrics.add_collected('duck_cache_hit_ratio', 'Disk cache hits / lookups since start.', 'gauge', ('cache',), _cache_stat('hit_rate'))
+    metrics.add_collected('duck_cache_bytes', 'Bytes stored in the disk cache.', 'gauge', ('cache',), _cache_stat('bytes'))
+
+# 批量接口单次最多文件数
+BATCH_MAX_FILES = int(os.environ.get('DUCK_BATCH_MAX_FILES', 100))
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'webp', 'mp4', 'avi', 'mov'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _busy_response(err):
+    """进程池排队已满：返回 503，并告诉客户端多久后重试"""
+    response = jsonify({'error': str(err)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(err.retry_after)
+    return response
+
+@app.before_request
+def _start_timer():
+    g.duck_request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    start = g.pop('duck_request_start', None)
+    if start is not None:
+        # 按路由模板聚合（如 /api/jobs/<job_id>），避免任务 id 撑大标签数
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - start)
+    return response
+
 @app.route('/')
 def index():
     """主页"""
     return render_template('index.html')
 
+def _parse_encode_form():
+    """
+    校验并读取编码参数，同步接口与异步任务共用。
+    返回 (参数字典, None)，参数非法时返回 (None, 错误响应)
+    """
+    # 检查文件
+    if 'file' not in request.files:
+        return None, (jsonify({'error': '没有上传文件'}), 400)
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': '文件名为空'}), 400)
+    
+    if not allowed_file(file.filename):
+        return None, (jsonify({'error': '不支持的文件格式'}), 400)
+    
+    # 获取参数
+    png_profile = request.form.get('png_profile', DEFAULT_PNG_PROFILE)
+    if png_profile not in PNG_PROFILES:
+        return None, (jsonify({'error': f"不支持的 png_profile，可选: {', '.join(PNG_PROFILES)}"}), 400)
+    
+    # 上传内容已流式写入磁盘缓冲并算好哈希，编码时直接从缓冲读入载荷，不整份 read()
+    # 视频也按原始容器字节直接嵌入，文件头记录精确长度
+    return {
+        'raw_bytes': file.stream,
+        'ext': file.filename.rsplit('.', 1)[1].lower(),
+        'password': request.form.get('password', ''),
+        'title': request.form.get('title', ''),
+        'compress': int(request.form.get('compress', 2)),
+        'square': request.form.get('canvas', 'square') != 'compact',
+        'png_profile': png_profile,
+    }, None
+
+def _parse_decode_form():
+    """校验并读取解码参数，返回 (参数字典, None) 或 (None, 错误响应)"""
+    # 检查文件
+    if 'file' not in request.files:
+        return None, (jsonify({'error': '没有上传文件'}), 400)
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': '文件名为空'}), 400)
+    
+    return {'png_bytes': file.stream, 'password': request.form.get('password', '')}, None
+
+def _detach_upload(file):
+    """
+    接管上传文件的底层流（不拷贝），由调用方负责关闭。
+    流式响应和异步任务在视图返回后才读取上传内容，而请求上下文结束时会关闭 request.files。
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+def _batch_zip_response(items, work, download_name):
+    """
+    流式返回批量处理的 zip。
+    各条目的上传流由 work 用完后关闭；客户端断开或响应生成器根本没有启动时，在响应关闭时统一关闭。
+    """
+    response = Response(
+        stream_with_context(stream_batch_zip(items, work, worker_pool.workers)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'},
+    )
+
+    @response.call_on_close
+    def _close_streams():
+        for item in items:
+            item['stream'].close()
+
+    return response
+
+def _duck_png_response(png_bytes, capacity):
+    """返回鸭子图，附带画布尺寸与浪费的容量"""
+    response = send_file(
+        io.BytesIO(png_bytes),
+        mimetype='image/png',
+        as_attachment=True,
+        download_name='duck_payload.png'
+    )
+    response.headers['X-Duck-Canvas'] = f"{capacity['width']}x{capacity['height']}"
+    response.headers['X-Duck-Wasted-Bits'] = str(capacity['wasted_bits'])
+    return response
+
+def _recovered_file_response(raw, clean_ext):
+    """按扩展名返回还原出的原始文件；clean_ext 不带前导点"""
+    if clean_ext in ['mp4', 'avi', 'mov']:
+        # 视频文件
+        mimetype = f'video/{clean_ext}'
+    elif clean_ext == 'txt':
+        # 文本文件
+        mimetype = 'text/plain'
+    elif clean_ext in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
+        # 图片文件
+        mimetype = f'image/{clean_ext}'
+    else:
+        # 其他文件
+        mimetype = 'application/octet-stream'
+    return send_file(
+        io.BytesIO(raw),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f'recovered.{clean_ext}'
+    )
+
+def _run_profiled(label, handler):
+    """
+    运维带上剖析请求头时，在请求线程内执行 handler 并剖析，响应头 X-Duck-Profile-File 给出结果文件名；
+    未开启时直接交给进程池执行。
+    """
+    try:
+        fmt = profiler.requested(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if fmt is None:
+        return handler()
+    with profiler.profile(fmt, label) as run:
+        response = app.make_response(handler(inline=True))
+    if run.path:
+        response.headers['X-Duck-Profile-File'] = os.path.basename(run.path)
+    return response
+
 @app.route('/api/encode', methods=['POST'])
 def encode():
     """
@@ -119,58 +294,27 @@ def encode():
     - password: 密码（可选）
     - title: 标题（可选）
     - compress: 压缩级别 2/6/8
+    - canvas: 画布形状 square（默认）/ compact（总像素最少的非正方形）
+    - png_profile: PNG 编码档位 fast / balanced / smallest（默认取 DUCK_PNG_PROFILE）
     """
+    return _run_profiled('encode', _encode_request)
+
+def _encode_request(inline=False):
     try:
-        # 检查文件
-        if 'file' not in request.files:
-            return jsonify({'error': '没有上传文件'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '文件名为空'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': '不支持的文件格式'}), 400
-        
-        # 获取参数
-        password = request.form.get('password', '')
-        title = request.form.get('title', '')
-        compress = int(request.form.get('compress', 2))
-        
-        # 读取文件内容
-        file_bytes = file.read()
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        
-        # 如果是视频，先转为二进制图片
-        if ext in ['mp4', 'avi', 'mov']:
-            bin_img = _bytes_to_binary_image(file_bytes, width=512)
-            with io.BytesIO() as buf:
-                bin_img.save(buf, format="PNG")
-                raw_bytes = buf.getvalue()
-            ext = f"{ext}.binpng"
-        else:
-            raw_bytes = file_bytes
-        
-        # 生成鸭子图
-        output_dir = tempfile.gettempdir()
-        out_path, duck_img = export_duck_payload(
-            raw_bytes=raw_bytes,
-            password=password,
-            ext=ext,
-            compress=compress,
-            title=title,
-            output_dir=output_dir,
-            output_name=f"duck_{os.urandom(8).hex()}.png"
-        )
-        
-        # 返回图片
-        return send_file(
-            out_path,
-            mimetype='image/png',
-            as_attachment=True,
-            download_name='duck_payload.png'
-        )
-        
+        params, error = _parse_encode_form()
+        if error:
+            return error
+        
+        # 先查去重缓存，未命中在进程池中生成鸭子图
+        png_bytes, capacity, hit = _encode_with_cache(**params, inline=inline)
+        response = _duck_png_response(png_bytes, capacity)
+        response.headers['X-Duck-Cache'] = 'hit' if hit else 'miss'
+        return response
+        
+    except PoolBusy as e:
+        return _busy_response(e)
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -183,99 +327,175 @@ def decode():
     - file: 鸭子图文件
     - password: 密码（可选）
     """
+    return _run_profiled('decode', _decode_request)
+
+def _decode_request(inline=False):
     try:
-        # 检查文件
-        if 'file' not in request.files:
-            return jsonify({'error': '没有上传文件'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': '文件名为空'}), 400
-        
-        # 获取密码
-        password = request.form.get('password', '')
-        
-        # 读取鸭子图
-        img = Image.open(file.stream).convert("RGB")
-        arr = np.array(img).astype(np.uint8)
-        
-        # 尝试不同的压缩级别解码
-        header = None
-        raw = None
-        ext = None
-        last_err = None
-        
-        for k in (2, 6, 8):
-            try:
-                header = _extract_payload_with_k(arr, k)
-                raw, ext = _parse_header(header, password)
-                break
-            except Exception as e:
-                last_err = e
-                continue
-        
-        if raw is None:
-            raise last_err or RuntimeError("解码失败，可能是密码错误或文件损坏")
-        
-        # 标准化扩展名（去掉前导点）
-        clean_ext = ext.lstrip('.')
-        
-        # 处理二进制图片格式（视频）
-        if ext.endswith('.binpng'):
-            # 从二进制图片还原视频
-            temp_png = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            temp_png.write(raw)
-            temp_png.close()
-            
-            # 读取二进制图片并转为视频字节
-            bin_img = Image.open(temp_png.name).convert("RGB")
-            bin_arr = np.array(bin_img).astype(np.uint8)
-            flat = bin_arr.reshape(-1, 3).reshape(-1)
-            video_bytes = flat.tobytes().rstrip(b"\x00")
-            
-            os.unlink(temp_png.name)
-            
-            # 正确提取原始视频格式：例如 "mp4.binpng" -> "mp4"
-            orig_ext = ext.replace('.binpng', '').lstrip('.')
-            return send_file(
-                io.BytesIO(video_bytes),
-                mimetype=f'video/{orig_ext}',
-                as_attachment=True,
-                download_name=f'recovered.{orig_ext}'
-            )
-        elif clean_ext == 'txt':
-            # 文本文件
-            return send_file(
-                io.BytesIO(raw),
-                mimetype='text/plain',
-                as_attachment=True,
-                download_name='recovered.txt'
-            )
-        elif clean_ext in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-            # 图片文件
-            return send_file(
-                io.BytesIO(raw),
-                mimetype=f'image/{clean_ext}',
-                as_attachment=True,
-                download_name=f'recovered.{clean_ext}'
-            )
+        params, error = _parse_decode_form()
+        if error:
+            return error
+        
+        # 先查缓存，未命中在进程池中解码；旧版 .binpng 视频已还原为原视频字节
+        raw, clean_ext, hit = _decode_with_cache(**params, inline=inline)
+        response = _recovered_file_response(raw, clean_ext)
+        response.headers['X-Duck-Cache'] = 'hit' if hit else 'miss'
+        return response
+        
+    except PoolBusy as e:
+        return _busy_response(e)
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交异步任务，立即返回任务 id
+    
+    参数：
+    - type: encode / decode
+    - 其余参数与 /api/encode、/api/decode 相同
+    """
+    try:
+        kind = request.form.get('type', 'encode')
+        if kind == 'encode':
+            params, error = _parse_encode_form()
+            if error:
+                return error
+            _detach_upload(request.files['file'])
+            job = job_store.submit_encode(**params)
+        elif kind == 'decode':
+            params, error = _parse_decode_form()
+            if error:
+                return error
+            _detach_upload(request.files['file'])
+            job = job_store.submit_decode(**params)
         else:
-            # 其他文件
-            return send_file(
-                io.BytesIO(raw),
-                mimetype='application/octet-stream',
-                as_attachment=True,
-                download_name=f'recovered.{clean_ext}'
-            )
+            return jsonify({'error': '不支持的任务类型，可选: encode, decode'}), 400
         
+        info = job_store.describe(job)
+        info['status_url'] = f'/api/jobs/{job.id}'
+        info['result_url'] = f'/api/jobs/{job.id}/result'
+        return jsonify(info), 202
+        
+    except PoolBusy as e:
+        return _busy_response(e)
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询异步任务状态与进度"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job_store.describe(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """获取异步任务结果，响应与同步接口一致"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if job.status == JOB_FAILED:
+        return jsonify({'error': job.error}), 500
+    if job.status != JOB_DONE:
+        return jsonify(job_store.describe(job)), 409
+    
+    if job.kind == 'encode':
+        return _duck_png_response(*job.result)
+    return _recovered_file_response(*job.result)
+
+@app.route('/api/encode/batch', methods=['POST'])
+def encode_batch():
+    """
+    批量编码接口：多个文件共用同一组参数，并发编码，流式返回 zip
+    
+    参数：
+    - files: 多个文件
+    - password / title / compress / canvas / png_profile: 与 /api/encode 相同，所有文件共用
+    
+    返回：zip，内含各文件的鸭子图与 manifest.json（逐个文件的成功 / 失败信息）
+    """
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': '没有上传文件'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'单次最多 {BATCH_MAX_FILES} 个文件'}), 400
+    
+    png_profile = request.form.get('png_profile', DEFAULT_PNG_PROFILE)
+    if png_profile not in PNG_PROFILES:
+        return jsonify({'error': f"不支持的 png_profile，可选: {', '.join(PNG_PROFILES)}"}), 400
+    try:
+        compress = int(request.form.get('compress', 2))
+    except ValueError:
+        return jsonify({'error': 'compress 必须是整数'}), 400
+    shared = {
+        'password': request.form.get('password', ''),
+        'title': request.form.get('title', ''),
+        'compress': compress,
+        'square': request.form.get('canvas', 'square') != 'compact',
+        'png_profile': png_profile,
+    }
+    
+    items = [{'index': i, 'filename': f.filename, 'stream': _detach_upload(f)} for i, f in enumerate(files)]
+    
+    def work(item):
+        filename = item['filename']
+        # 上传缓冲直接交给编码流程，同一时刻只有正在编码的文件在内存里
+        with item['stream'] as stream:
+            if not filename or not allowed_file(filename):
+                raise ValueError('不支持的文件格式')
+            ext = filename.rsplit('.', 1)[1].lower()
+            png_bytes, capacity, _ = _encode_with_cache(stream, ext, wait=True, **shared)
+        stem = secure_filename(filename.rsplit('.', 1)[0]) or 'file'
+        arcname = f"{item['index'] + 1:03d}_{stem}.png"
+        return arcname, png_bytes, {'canvas': f"{capacity['width']}x{capacity['height']}"}
+    
+    return _batch_zip_response(items, work, 'duck_batch.zip')
+
+@app.route('/api/decode/batch', methods=['POST'])
+def decode_batch():
+    """
+    批量解码接口：多张鸭子图共用同一密码，并发解码，流式返回 zip
+    
+    参数：
+    - files: 多张鸭子图
+    - password: 密码（可选，所有图片共用）
+    
+    返回：zip，内含还原出的文件与 manifest.json（扩展名、大小、逐个文件的错误）
+    """
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': '没有上传文件'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'单次最多 {BATCH_MAX_FILES} 个文件'}), 400
+    
+    password = request.form.get('password', '')
+    items = [{'index': i, 'filename': f.filename, 'stream': _detach_upload(f)} for i, f in enumerate(files)]
+    
+    def work(item):
+        with item['stream'] as stream:
+            raw, clean_ext, _ = _decode_with_cache(stream, password, wait=True)
+        stem = secure_filename((item['filename'] or '').rsplit('.', 1)[0]) or 'recovered'
+        arcname = f"{item['index'] + 1:03d}_{stem}.{clean_ext}"
+        return arcname, raw, {'ext': clean_ext}
+    
+    return _batch_zip_response(items, work, 'duck_recovered.zip')
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """健康检查"""
     return jsonify({'status': 'ok', 'version': '1.2'})
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式的进程内指标"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/merge-videos', methods=['POST'])
 def merge_videos():
     """
@@ -322,7 +542,9 @@ def merge_videos():
             '-y'
         ]
         
+        ffmpeg_start = time.perf_counter()
         result = subprocess.run(cmd, capture_output=True, text=True)
+        metrics.stage_seconds.observe(time.perf_counter() - ffmpeg_start, op='merge', stage='ffmpeg')
         
         # 清理临时文件
         for temp_file in temp_files:
@@ -398,7 +620,11 @@ def fetch_image():
     except Exception as e:
         return jsonify({'error': f'获取图片失败: {str(e)}'}), 500
 
+# Gunicorn 以 app:app 导入时同样需要这些服务，只跳过工作进程
+if __name__ != '__mp_main__':
+    _init_services()
+
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 8888))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
@@ -0,0 +1,87 @@
+"""
+批量编解码的 zip 流式输出
+- 每个条目在线程池中并发处理，实际计算仍交给 DuckWorkerPool
+- 哪个条目先完成就先写进 zip 并立即发给客户端，不在内存中拼出整个压缩包
+- 单个条目失败只记录到 manifest.json，不中断整个批次
+"""
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 这些异常的消息是写给用户的（参数、容量、密码、服务繁忙等），其余异常可能带有服务器路径等内部信息
+USER_FACING_ERRORS = (ValueError, RuntimeError)
+
+
+class _ZipStreamSink:
+    """zipfile 的只写目标：收集写入的字节，由生成器随时取走。"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # zipfile 写不可 seek 的流时需要知道当前偏移量来记录中央目录
+        return self._offset
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_batch_zip(items, work, workers: int, manifest_extra=None):
+    """
+    并发处理 items 并逐个产出 zip 数据块。
+    - work(item) 返回 (压缩包内文件名, 文件字节, manifest 附加信息字典)，失败时抛出异常
+    - 每个 item 需带 index 与 filename 两个键，用于 manifest；可选的 stream 键为该条目的上传流
+    - manifest 只记录 USER_FACING_ERRORS 的消息，其余异常统一记为“处理失败”
+    """
+    sink = _ZipStreamSink()
+    manifest = []
+    # PNG 与大多数载荷已经是压缩格式，直接存储，省掉再压缩的 CPU
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="duck-batch") as executor:
+            futures = {executor.submit(work, item): item for item in items}
+            try:
+                for future in as_completed(futures):
+                    item = futures[future]
+                    entry = {"index": item["index"], "filename": item["filename"]}
+                    try:
+                        arcname, data, extra = future.result()
+                    except USER_FACING_ERRORS as e:
+                        entry.update(status="error", error=str(e))
+                    except Exception:
+                        entry.update(status="error", error="Processing failed. 处理失败")
+                    else:
+                        zf.writestr(arcname, data)
+                        entry.update(status="ok", output=arcname, bytes=len(data), **extra)
+                        del data
+                    manifest.append(entry)
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            except GeneratorExit:
+                # 客户端断开：取消还没开始的条目，不再占用进程池；被取消的条目不会再执行 work，由这里关闭其上传流
+                for future, item in futures.items():
+                    if future.cancel() and item.get("stream") is not None:
+                        item["stream"].close()
+                raise
+        manifest.sort(key=lambda e: e["index"])
+        summary = {
+            "total": len(manifest),
+            "succeeded": sum(1 for e in manifest if e["status"] == "ok"),
+            "failed": sum(1 for e in manifest if e["status"] == "error"),
+            "files": manifest,
+        }
+        if manifest_extra:
+            summary.update(manifest_extra)
+        zf.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+    yield sink.drain()
@@ -0,0 +1,192 @@
+"""
+按内容寻址的磁盘 LRU 缓存
+- 键由调用方对输入内容做哈希得到，值为任意字节串，每条一个文件
+- 按总字节数淘汰最久未命中的条目，超过 TTL 的条目视为未命中并删除
+- 命中只读一个文件，不经过 PIL / NumPy
+- 多个进程共享同一目录时各自维护索引，文件以 os.replace 原子写入，被其他进程删掉的条目按未命中处理
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class DiskLRUCache:
+    """
+    磁盘 LRU 缓存。
+    - max_bytes：缓存文件总字节数上限，0 表示禁用
+    - ttl：条目写入后的有效秒数
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._index = OrderedDict()  # key -> (字节数, 写入时间)，末尾为最近使用
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load_index(self) -> None:
+        """从目录重建索引，重启后按文件修改时间近似恢复 LRU 顺序。"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (size, mtime)
+            self._total += size
+        with self._lock:
+            self._evict(0)
+
+    def _drop(self, key: str) -> None:
+        """从索引和磁盘删除一条；调用方持有锁。"""
+        size, _ = self._index.pop(key)
+        self._total -= size
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, incoming: int) -> None:
+        """淘汰最久未使用的条目直到能放下 incoming 字节；调用方持有锁。"""
+        while self._index and self._total + incoming > self.max_bytes:
+            key = next(iter(self._index))
+            self._drop(key)
+            self.evictions += 1
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            meta = self._index.get(key)
+            if meta is not None and time.time() - meta[1] > self.ttl:
+                self._drop(key)
+                meta = None
+            if meta is None:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._index:
+                    size, _ = self._index.pop(key)
+                    self._total -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            if key in self._index:
+                size, _ = self._index.pop(key)
+                self._total -= size
+            self._evict(len(data))
+            self._index[key] = (len(data), time.time())
+            self._total += len(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def content_digest(src) -> bytes:
+    """内容的 SHA-256：上传缓冲在接收时已算好，直接取用；bytes-like 现算。"""
+    if hasattr(src, "sha256"):
+        return src.sha256()
+    return hashlib.sha256(src).digest()
+
+
+def decode_cache_key(png_bytes, password: str) -> str:
+    """解码缓存键：图片字节哈希 + 密码哈希，磁盘上不出现明文密码。"""
+    h = hashlib.sha256()
+    h.update(content_digest(png_bytes))
+    h.update(hashlib.sha256(password.encode("utf-8")).digest())
+    return "dec-" + h.hexdigest()
+
+
+def pack_decode_result(raw: bytes, ext: str) -> bytes:
+    ext_b = ext.encode("utf-8")
+    return bytes([len(ext_b)]) + ext_b + raw
+
+
+def unpack_decode_result(blob: bytes):
+    ext_len = blob[0]
+    return blob[1 + ext_len:], blob[1:1 + ext_len].decode("utf-8")
+
+
+def encode_cache_key(raw_bytes, ext: str, title: str, compress: int, square: bool, png_profile: str) -> str:
+    """编码去重键：无密码时输出只由这些输入决定。"""
+    h = hashlib.sha256()
+    h.update(content_digest(raw_bytes))
+    params = json.dumps([ext, title, compress, square, png_profile], ensure_ascii=False)
+    h.update(params.encode("utf-8"))
+    return "enc-" + h.hexdigest()
+
+
+def pack_encode_result(png_bytes: bytes, capacity: dict) -> bytes:
+    meta = json.dumps(capacity).encode("utf-8")
+    return struct.pack(">I", len(meta)) + meta + png_bytes
+
+
+def unpack_encode_result(blob: bytes):
+    meta_len = struct.unpack(">I", blob[:4])[0]
+    return blob[4 + meta_len:], json.loads(blob[4:4 + meta_len])
+
+
+def decode_cache_from_env() -> DiskLRUCache:
+    directory = os.environ.get('DUCK_DECODE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'duck_decode_cache'))
+    max_bytes = int(os.environ.get('DUCK_DECODE_CACHE_BYTES', 512 * 1024 * 1024))
+    ttl = float(os.environ.get('DUCK_DECODE_CACHE_TTL', 24 * 3600))
+    return DiskLRUCache(directory, max_bytes, ttl)
+
+
+def encode_cache_from_env() -> DiskLRUCache:
+    directory = os.environ.get('DUCK_ENCODE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'duck_encode_cache'))
+    max_bytes = int(os.environ.get('DUCK_ENCODE_CACHE_BYTES', 512 * 1024 * 1024))
+    ttl = float(os.environ.get('DUCK_ENCODE_CACHE_TTL', 24 * 3600))
+    return DiskLRUCache(directory, max_bytes, ttl)
@@ -0,0 +1,181 @@
+"""
+异步编解码任务
+- POST 提交后立即返回任务 id，计算在后台线程中交给 DuckWorkerPool 执行
+- 结果与同步接口使用同一套 encode_payload / decode_payload，逐字节一致
+- 保留策略：已结束的任务超过 TTL、总数超过上限或结果总字节数超过上限时按结束时间从旧到新清理
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from duck_worker import PoolBusy
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# 按阶段给出的粗略进度：编解码在工作进程内一次完成，无法再细分
+_STAGE_PROGRESS = {JOB_QUEUED: 0.0, JOB_RUNNING: 0.5, JOB_DONE: 1.0, JOB_FAILED: 1.0}
+
+
+def _release_args(args) -> None:
+    """关闭任务参数中的上传缓冲。"""
+    for arg in args:
+        if hasattr(arg, "close"):
+            arg.close()
+
+
+class DuckJob:
+    """单个异步任务的状态与结果。"""
+
+    def __init__(self, kind: str, args: tuple, kwargs: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._args = args
+        self._kwargs = kwargs
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    @property
+    def result_bytes(self) -> int:
+        return len(self.result[0]) if self.result is not None else 0
+
+    def to_dict(self, queue_position=None) -> dict:
+        info = {
+            "job_id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "progress": _STAGE_PROGRESS[self.status],
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if queue_position is not None:
+            info["queue_position"] = queue_position
+        if self.status == JOB_FAILED:
+            info["error"] = self.error
+        if self.status == JOB_DONE:
+            info["result_bytes"] = self.result_bytes
+        return info
+
+
+class DuckJobStore:
+    """
+    有界的异步任务表。
+    - runners：同时向进程池提交任务的线程数
+    - max_jobs：保留的任务总数上限（含未结束的任务）；全部未结束且已满时提交会抛出 PoolBusy
+    - ttl：已结束任务的结果保留秒数
+    - max_result_bytes：内存中保留的结果总字节数上限；刚完成的任务即使单独超出也保留，直到下一个任务完成
+    - encode_fn / decode_fn：实际执行函数，默认直接调用进程池，可替换为带缓存的版本
+    """
+
+    def __init__(self, pool, runners: int, max_jobs: int, ttl: float, max_result_bytes: int,
+                 encode_fn=None, decode_fn=None):
+        self.pool = pool
+        self.encode_fn = encode_fn or pool.encode
+        self.decode_fn = decode_fn or pool.decode
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.max_result_bytes = max_result_bytes
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._runner = ThreadPoolExecutor(max_workers=runners, thread_name_prefix="duck-job")
+
+    @classmethod
+    def from_env(cls, pool, encode_fn=None, decode_fn=None) -> "DuckJobStore":
+        runners = int(os.environ.get('DUCK_JOB_RUNNERS', max(1, pool.workers)))
+        max_jobs = int(os.environ.get('DUCK_JOB_MAX', 64))
+        ttl = float(os.environ.get('DUCK_JOB_TTL', 600))
+        max_result_bytes = int(os.environ.get('DUCK_JOB_MAX_BYTES', 512 * 1024 * 1024))
+        return cls(pool, runners, max_jobs, ttl, max_result_bytes, encode_fn, decode_fn)
+
+    def _purge(self, now: float, room: int = 0, keep=None) -> None:
+        """
+        清理过期任务，并淘汰最早结束的任务直到能再放下 room 个、结果总字节数不超过上限；调用方持有锁。
+        keep 为刚完成的任务，不因字节数上限被淘汰。
+        """
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        held = sum(j.result_bytes for j in finished)
+        for job in finished:
+            over_bytes = held > self.max_result_bytes and job is not keep
+            if now - job.finished_at > self.ttl or len(self._jobs) + room > self.max_jobs or over_bytes:
+                del self._jobs[job.id]
+                held -= job.result_bytes
+
+    def submit_encode(self, raw_bytes, ext, password, title, compress, square=True, png_profile=None) -> DuckJob:
+        kwargs = {"square": square}
+        if png_profile is not None:
+            kwargs["png_profile"] = png_profile
+        return self._submit("encode", (raw_bytes, ext, password, title, compress), kwargs)
+
+    def submit_decode(self, png_bytes, password) -> DuckJob:
+        return self._submit("decode", (png_bytes, password), {})
+
+    def _submit(self, kind: str, args: tuple, kwargs: dict) -> DuckJob:
+        job = DuckJob(kind, args, kwargs)
+        with self._lock:
+            self._purge(time.time(), room=1)
+            if len(self._jobs) >= self.max_jobs:
+                # 任务不会执行，交进来的上传缓冲由这里关闭
+                _release_args(args)
+                raise PoolBusy(self.pool.retry_after)
+            self._jobs[job.id] = job
+        self._runner.submit(self._run, job)
+        return job
+
+    def _run(self, job: DuckJob) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        work = self.encode_fn if job.kind == "encode" else self.decode_fn
+        try:
+            # 后台任务不应因同步请求占满队列而失败，排队等待空位
+            job.result = work(*job._args, wait=True, **job._kwargs)
+            status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            status = JOB_FAILED
+        # 任务持有的上传缓冲到此用完
+        _release_args(job._args)
+        job._args = job._kwargs = None
+        # 先记录结束时间再切换状态，清理逻辑只看已结束任务的 finished_at
+        job.finished_at = time.time()
+        job.status = status
+        with self._lock:
+            self._purge(job.finished_at, keep=job)
+
+    def get(self, job_id: str):
+        with self._lock:
+            self._purge(time.time())
+            return self._jobs.get(job_id)
+
+    def describe(self, job: DuckJob) -> dict:
+        queue_position = None
+        if job.status == JOB_QUEUED:
+            with self._lock:
+                queued = [j.id for j in self._jobs.values() if j.status == JOB_QUEUED]
+            if job.id in queued:
+                queue_position = queued.index(job.id)
+        return job.to_dict(queue_position)
+
+    def counts(self) -> dict:
+        """各状态的任务数。"""
+        counts = dict.fromkeys(_STAGE_PROGRESS, 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def shutdown(self) -> None:
+        self._runner.shutdown(wait=True)
@@ -0,0 +1,176 @@
+"""
+进程内的 Prometheus 指标
+- 计数器与直方图在本进程内累计，/api/metrics 按 Prometheus 文本格式输出，不依赖外部服务
+- 工作进程内测得的各阶段耗时随编解码结果一起带回，由主进程统一记录
+- 缓存、进程池、任务表等状态在抓取时现取，不额外维护
+- gunicorn 多进程部署时每个进程各自计数，需逐个进程抓取或只开一个进程
+"""
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 请求与阶段耗时的桶（秒）：从几毫秒的缓存命中到上百秒的大文件编码
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 载荷大小的桶（字节）：1KB 到 256MB，按 4 倍递增
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """按标签分组的单调递增计数。"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels) -> None:
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """按标签分组的累计直方图，桶上界含等号（le）。"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 标签 -> [各桶计数（末尾为 +Inf）, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels) -> None:
+        key = tuple(labels[n] for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        bounds = self.buckets + (float("inf"),)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield self.name + "_bucket", _format_labels(self.labelnames, key, le), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, key), total
+            yield self.name + "_count", _format_labels(self.labelnames, key), cumulative
+
+
+class Collected:
+    """抓取时由 collect() 现取的指标；collect 返回 [(标签值元组, 数值), ...]。"""
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames, collect):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+
+    def samples(self):
+        for key, value in self._collect():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class DuckMetrics:
+    """本服务的指标集合。"""
+
+    def __init__(self):
+        self.requests = Counter(
+            "duck_http_requests_total", "HTTP requests by endpoint, method and status.",
+            ("endpoint", "method", "status"),
+        )
+        self.request_seconds = Histogram(
+            "duck_http_request_duration_seconds",
+            "Time to produce the response (time to first byte for streamed responses).",
+            LATENCY_BUCKETS, ("endpoint",),
+        )
+        self.stage_seconds = Histogram(
+            "duck_stage_duration_seconds", "Time spent in each pipeline stage per successful operation.",
+            LATENCY_BUCKETS, ("op", "stage"),
+        )
+        self.payload_bytes = Histogram(
+            "duck_payload_bytes", "Payload size: uploaded file for encode, recovered file for decode.",
+            SIZE_BUCKETS, ("op",),
+        )
+        self.lsb_depth = Counter(
+            "duck_lsb_depth_total", "Encodes and decodes by LSB depth (cache hits excluded).",
+            ("op", "depth"),
+        )
+        self.template_cache = Counter(
+            "duck_template_cache_lookups_total",
+            "Duck background / title cache lookups in the workers by result (hit or miss).",
+            ("op", "cache", "result"),
+        )
+        self._metrics = [
+            self.requests, self.request_seconds, self.stage_seconds, self.payload_bytes, self.lsb_depth,
+            self.template_cache,
+        ]
+
+    def add_collected(self, name: str, help_text: str, kind: str, labelnames, collect) -> None:
+        """注册抓取时现取的指标，kind 为 gauge 或 counter。"""
+        self._metrics.append(Collected(name, help_text, kind, labelnames, collect))
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float) -> None:
+        self.requests.inc(endpoint=endpoint, method=method, status=str(status))
+        self.request_seconds.observe(seconds, endpoint=endpoint)
+
+    def observe_stages(self, op: str, stages) -> None:
+        """记录一次编解码的 DuckStageLog，可直接作为 DuckWorkerPool 的 on_stages 回调。"""
+        for stage, seconds in stages.timings.items():
+            self.stage_seconds.observe(seconds, op=op, stage=stage)
+        if stages.lsb_depth is not None:
+            self.lsb_depth.inc(op=op, depth=str(stages.lsb_depth))
+        for cache, (hits, misses) in stages.cache_lookups.items():
+            if hits:
+                self.template_cache.inc(hits, op=op, cache=cache, result="hit")
+            if misses:
+                self.template_cache.inc(misses, op=op, cache=cache, result="miss")
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
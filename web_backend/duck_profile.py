@@ -0,0 +1,146 @@
+"""
+按请求开启的性能剖析（仅供运维排查）
+- 设置 DUCK_PROFILE_TOKEN 后才可用；请求头 X-Duck-Profile 与之相同的编码 / 解码请求会在请求线程内执行并被剖析
+- X-Duck-Profile-Format：pstats（cProfile 确定性剖析，默认）或 collapsed（采样得到的折叠栈，可交给 flamegraph.pl / speedscope）
+- 结果写入 DUCK_PROFILE_DIR，只保留最新的 DUCK_PROFILE_MAX_FILES 个文件，文件名通过响应头 X-Duck-Profile-File 返回
+- 未设置 DUCK_PROFILE_TOKEN 时每个请求只多一次属性判断，不读请求头、不创建任何对象
+"""
+import cProfile
+import hmac
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_FORMATS = {"pstats": ".pstats", "collapsed": ".collapsed"}
+PROFILE_FILE_PREFIX = "duck-profile-"
+
+
+class _StackSampler:
+    """后台线程按固定间隔抓取目标线程的调用栈，累计为折叠栈计数。"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="duck-profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileRun:
+    """一次剖析的结果文件；同时有其他请求在剖析时 path 为 None，请求照常执行。"""
+
+    def __init__(self):
+        self.path = None
+
+
+class DuckProfiler:
+    """
+    按请求开启的剖析器。
+    - token：为空表示禁用
+    - max_files：目录内保留的剖析文件数上限，超出时删除最旧的
+    - sample_interval：collapsed 格式的采样间隔（秒）
+    """
+
+    def __init__(self, token: str, directory: str, max_files: int, sample_interval: float):
+        self.token = token
+        self.directory = directory
+        self.max_files = max_files
+        self.sample_interval = sample_interval
+        # cProfile 与采样都以单个请求为单位，同一时刻只剖析一个请求
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DuckProfiler":
+        token = os.environ.get('DUCK_PROFILE_TOKEN', '')
+        directory = os.environ.get('DUCK_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'duck_profiles'))
+        max_files = int(os.environ.get('DUCK_PROFILE_MAX_FILES', 20))
+        sample_interval = float(os.environ.get('DUCK_PROFILE_SAMPLE_INTERVAL', 0.005))
+        return cls(token, directory, max_files, sample_interval)
+
+    def requested(self, headers):
+        """请求要求剖析且口令正确时返回格式名，否则返回 None。"""
+        if not self.token:
+            return None
+        given = headers.get('X-Duck-Profile')
+        if not given or not hmac.compare_digest(given.encode('utf-8'), self.token.encode('utf-8')):
+            return None
+        fmt = headers.get('X-Duck-Profile-Format', 'pstats')
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format: {fmt}. 不支持的剖析格式，可选 {', '.join(PROFILE_FORMATS)}")
+        return fmt
+
+    @contextmanager
+    def profile(self, fmt: str, label: str):
+        """剖析 with 块内当前线程的执行，退出时写入文件并记录到产出的 ProfileRun。"""
+        run = ProfileRun()
+        if not self._lock.acquire(blocking=False):
+            yield run
+            return
+        try:
+            if fmt == "pstats":
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    yield run
+                finally:
+                    prof.disable()
+                    run.path = self._write(label, fmt, prof.dump_stats)
+            else:
+                sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+                try:
+                    with sampler:
+                        yield run
+                finally:
+                    run.path = self._write(label, fmt, sampler.write)
+        finally:
+            self._lock.release()
+
+    def _write(self, label: str, fmt: str, dump) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{PROFILE_FILE_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}{PROFILE_FORMATS[fmt]}"
+        path = os.path.join(self.directory, name)
+        dump(path)
+        self._prune()
+        return path
+
+    def _prune(self) -> None:
+        """只保留最新的 max_files 个剖析文件。"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.startswith(PROFILE_FILE_PREFIX):
+                entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
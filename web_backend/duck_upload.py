@@ -0,0 +1,59 @@
+"""
+上传文件的流式接收
+- 表单解析时每个上传文件直接写入磁盘临时文件，不在内存里拼出整个文件
+- 边写边计算 SHA-256 与大小，超过单文件上限立即中止（413），缓存键无需再读一遍文件
+- 编解码时按路径交给工作进程，或直接 readinto 载荷缓冲区，避免 file.read() 产生的整份拷贝
+"""
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class UploadSpool:
+    """上传文件的磁盘缓冲：接收时累计哈希与大小，读取接口与普通二进制文件一致。"""
+
+    def __init__(self, max_bytes: int, directory=None):
+        self._file = tempfile.NamedTemporaryFile(prefix='duck-upload-', dir=directory)
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f'单个文件超过 {self.max_bytes // (1024 * 1024)}MB 上限')
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def sha256(self) -> bytes:
+        """已接收内容的 SHA-256 摘要。"""
+        return self._sha256.digest()
+
+    @property
+    def name(self) -> str:
+        return self._file.name
+
+    def __getattr__(self, attr):
+        # read / readinto / seek / tell / flush / fileno / close 等直接转给临时文件
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class DuckRequest(Request):
+    """把上传文件写入 UploadSpool 的请求类。"""
+
+    # 单个上传文件的大小上限；整个请求体仍受 MAX_CONTENT_LENGTH 约束
+    max_file_bytes = 100 * 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(self.max_file_bytes)
@@ -0,0 +1,324 @@
+"""
+鸭鸭图编解码任务与后台进程池
+- encode_payload / decode_payload：与同步接口完全一致的编解码逻辑
+- DuckWorkerPool：编码 / 解码在独立进程中执行，不阻塞 Flask 请求线程
+  - 磁盘上的上传缓冲只传路径，由工作进程直接读入；其余大块数据通过共享内存传递，不经过 pickle
+  - 运行中 + 排队的任务数超过上限时立即抛出 PoolBusy，由路由返回 503 + Retry-After
+  - 工作进程崩溃（如被 OOM 杀掉）后丢弃损坏的进程池，下一次提交时重建
+"""
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import get_context, shared_memory
+
+from PIL import Image, UnidentifiedImageError
+
+# 添加 SS_tools-main 到 Python 路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SS_tools-main'))
+from duck_payload_exporter import (
+    DEFAULT_PNG_PROFILE,
+    collect_duck_stages,
+    export_duck_payload_to_buffer,
+    _binary_image_to_bytes,
+    _detect_lsb_depths,
+    _extract_payload_with_k,
+    _image_to_rgb_array,
+    _note_lsb_depth,
+    _parse_header,
+)
+
+
+def encode_payload(raw_bytes, ext: str, password: str, title: str, compress: int,
+                   square: bool = True, png_profile: str = DEFAULT_PNG_PROFILE):
+    """生成鸭子图 PNG，返回 (PNG 字节, 容量报告)；raw_bytes 可以是 bytes-like 或已定位到开头的二进制文件。"""
+    png_buf = io.BytesIO()
+    duck_img = export_duck_payload_to_buffer(
+        raw_bytes=raw_bytes,
+        password=password,
+        ext=ext,
+        compress=compress,
+        title=title,
+        buffer=png_buf,
+        square=square,
+        png_profile=png_profile,
+    )
+    return png_buf.getvalue(), duck_img.info["duck_capacity"]
+
+
+def decode_payload(png_bytes, password: str):
+    """
+    从鸭子图 PNG 中还原载荷，返回 (原始字节, 扩展名)；旧版 .binpng 视频还原为原视频字节和扩展名。
+    png_bytes 可以是 bytes-like 或二进制文件对象。
+    """
+    try:
+        with Image.open(png_bytes if hasattr(png_bytes, "read") else io.BytesIO(png_bytes)) as img:
+            arr = _image_to_rgb_array(img)
+    except (UnidentifiedImageError, OSError):
+        # PIL 的报错里带有上传缓冲的路径，不原样返回给客户端
+        raise ValueError("Not a valid duck image. 不是有效的鸭子图") from None
+
+    # 只在探测到的位深上做完整提取
+    raw = None
+    ext = None
+    last_err = None
+    for k in _detect_lsb_depths(arr):
+        try:
+            header = _extract_payload_with_k(arr, k)
+            raw, ext = _parse_header(header, password)
+            _note_lsb_depth(k)
+            break
+        except Exception as e:
+            last_err = e
+            continue
+
+    if raw is None:
+        raise last_err or RuntimeError("解码失败，可能是密码错误或文件损坏")
+
+    # 处理旧版二进制图片格式（视频），新版视频直接以原始字节嵌入
+    if ext.endswith('.binpng'):
+        # 正确提取原始视频格式：例如 "mp4.binpng" -> "mp4"
+        return _binary_image_to_bytes(io.BytesIO(raw)), ext.replace('.binpng', '').lstrip('.')
+    return raw, ext.lstrip('.')
+
+
+# ===================== 共享内存传递 =====================
+def _put_shared(data) -> tuple:
+    """把数据拷进一块新的共享内存，返回可 pickle 的引用 (name, size)。"""
+    size = len(data)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    shm.buf[:size] = data
+    ref = (shm.name, size)
+    shm.close()
+    return ref
+
+
+@contextmanager
+def _attach_shared(ref):
+    """以只读视图方式挂载共享内存，不拷贝；退出时释放视图。"""
+    name, size = ref
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf[:size]
+    try:
+        yield view
+    finally:
+        view.release()
+        shm.close()
+
+
+def _is_disk_file(src) -> bool:
+    name = getattr(src, "name", None)
+    return hasattr(src, "readinto") and isinstance(name, str) and os.path.isfile(name)
+
+
+def _share_input(src) -> tuple:
+    """
+    把任务输入交给工作进程：磁盘文件（如上传缓冲）只传路径，不拷贝；其余放进共享内存。
+    返回 ("file", 路径) 或 ("shm", (name, size))。
+    """
+    if _is_disk_file(src):
+        src.flush()
+        return "file", src.name
+    return "shm", _put_shared(src)
+
+
+@contextmanager
+def _open_input(ref):
+    """工作进程侧打开 _share_input 的引用：文件得到二进制文件对象，共享内存得到只读视图。"""
+    kind, target = ref
+    if kind == "file":
+        with open(target, "rb") as f:
+            yield f
+    else:
+        with _attach_shared(target) as view:
+            yield view
+
+
+def _release_input(ref) -> None:
+    if ref[0] == "shm":
+        _unlink_shared(ref[1])
+
+
+def _take_shared(ref) -> bytes:
+    """取出共享内存中的数据并释放该块。"""
+    name, size = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _unlink_shared(ref) -> None:
+    try:
+        shm = shared_memory.SharedMemory(name=ref[0])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _encode_job(raw_ref, ext, password, title, compress, square, png_profile):
+    with _open_input(raw_ref) as raw_bytes, collect_duck_stages() as stages:
+        png_bytes, capacity = encode_payload(raw_bytes, ext, password, title, compress, square, png_profile)
+    return _put_shared(png_bytes), capacity, stages
+
+
+def _decode_job(png_ref, password):
+    with _open_input(png_ref) as png_bytes, collect_duck_stages() as stages:
+        raw, ext = decode_payload(png_bytes, password)
+    return _put_shared(raw), ext, stages
+
+
+def _rewind(src) -> None:
+    # 上传缓冲可能已被读过（例如计算缓存键），从头开始交给编解码
+    if hasattr(src, "seek"):
+        src.seek(0)
+
+
+# ===================== 进程池 =====================
+class PoolBusy(RuntimeError):
+    """运行中与排队的任务已达上限。"""
+
+    def __init__(self, retry_after: int, message: str = "Server busy, please retry later. 服务繁忙，请稍后重试"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WorkerCrashed(PoolBusy):
+    """工作进程在执行任务时异常退出；进程池已重建，客户端可稍后重试。"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after, "Worker process crashed, please retry later. 工作进程异常退出，请稍后重试")
+
+
+class DuckWorkerPool:
+    """
+    有界的编解码进程池。
+    - workers：工作进程数，0 表示在请求线程内直接执行（仍受排队上限约束）
+    - queue_depth：除正在执行的任务外最多排队的任务数
+    - on_stages：每次编解码成功后以 ("encode" / "decode", DuckStageLog) 回调，用于汇总各阶段耗时
+    """
+
+    def __init__(self, workers: int, queue_depth: int, retry_after: int = 5, on_stages=None):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self.on_stages = on_stages
+        self._slots = threading.BoundedSemaphore(max(1, workers) + queue_depth)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._executor = None
+
+    @classmethod
+    def from_env(cls, on_stages=None) -> "DuckWorkerPool":
+        workers = int(os.environ.get('DUCK_WORKERS', min(4, os.cpu_count() or 1)))
+        queue_depth = int(os.environ.get('DUCK_QUEUE_DEPTH', 2 * max(1, workers)))
+        retry_after = int(os.environ.get('DUCK_RETRY_AFTER', 5))
+        return cls(workers, queue_depth, retry_after, on_stages)
+
+    def _get_executor(self):
+        # 首次提交时才创建：spawn 子进程会重新导入 app 模块，不应在导入时就拉起进程
+        with self._lock:
+            if self._executor is None:
+                # spawn：Flask 是多线程的，避免 fork 带锁的进程状态
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+            return self._executor
+
+    def _discard_executor(self, executor) -> None:
+        # 只丢弃出错的那个池：其他线程可能已经换上了新池
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        """
+        在进程池中执行 fn 并返回结果。
+        提交时池已损坏（例如空闲的工作进程被杀）说明任务还没执行，换新池重新提交一次；
+        执行中工作进程崩溃则丢弃该池并抛出 WorkerCrashed，不重跑可能再次撑爆内存的任务。
+        """
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                raise WorkerCrashed(self.retry_after) from None
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise WorkerCrashed(self.retry_after) from None
+
+    @contextmanager
+    def _slot(self, wait: bool):
+        if not self._slots.acquire(blocking=wait):
+            raise PoolBusy(self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _report(self, op: str, stages) -> None:
+        if self.on_stages is not None:
+            self.on_stages(op, stages)
+
+    def encode(self, raw_bytes, ext: str, password: str, title: str, compress: int,
+               square: bool = True, png_profile: str = DEFAULT_PNG_PROFILE, wait: bool = False,
+               inline: bool = False):
+        """
+        返回 (PNG 字节, 容量报告)；wait=True 时排队已满也等待空位，而不是抛出 PoolBusy。
+        inline=True 时占用同样的名额，但在调用线程内执行（用于性能剖析）。
+        """
+        with self._slot(wait):
+            _rewind(raw_bytes)
+            if self.workers == 0 or inline:
+                with collect_duck_stages() as stages:
+                    result = encode_payload(raw_bytes, ext, password, title, compress, square, png_profile)
+                self._report("encode", stages)
+                return result
+            raw_ref = _share_input(raw_bytes)
+            try:
+                png_ref, capacity, stages = self._run(
+                    _encode_job, raw_ref, ext, password, title, compress, square, png_profile
+                )
+            finally:
+                _release_input(raw_ref)
+        result = _take_shared(png_ref), capacity
+        self._report("encode", stages)
+        return result
+
+    def decode(self, png_bytes, password: str, wait: bool = False, inline: bool = False):
+        """返回 (原始字节, 扩展名)；wait / inline 与 encode 相同。"""
+        with self._slot(wait):
+            _rewind(png_bytes)
+            if self.workers == 0 or inline:
+                with collect_duck_stages() as stages:
+                    result = decode_payload(png_bytes, password)
+                self._report("decode", stages)
+                return result
+            png_ref = _share_input(png_bytes)
+            try:
+                raw_ref, ext, stages = self._run(_decode_job, png_ref, password)
+            finally:
+                _release_input(png_ref)
+        result = _take_shared(raw_ref), ext
+        self._report("decode", stages)
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
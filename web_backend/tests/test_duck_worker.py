@@ -0,0 +1,75 @@
+"""
+DuckWorkerPool 在工作进程崩溃后的恢复
+运行：cd web_backend && python -m pytest -q tests
+"""
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from duck_worker import DuckWorkerPool, WorkerCrashed
+
+
+def _wait_until(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@unittest.skipUnless(hasattr(signal, "SIGKILL"), "需要 SIGKILL")
+class WorkerCrashRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = DuckWorkerPool(workers=1, queue_depth=2, retry_after=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def _kill_workers(self):
+        executor = self.pool._executor
+        for proc in list(executor._processes.values()):
+            os.kill(proc.pid, signal.SIGKILL)
+        return executor
+
+    def _assert_round_trip(self, payload: bytes):
+        png_bytes, _ = self.pool.encode(payload, "txt", "", "", 2)
+        raw, ext = self.pool.decode(png_bytes, "")
+        self.assertEqual(raw, payload)
+        self.assertEqual(ext, "txt")
+
+    def test_idle_worker_killed(self):
+        self._assert_round_trip(b"before crash")
+        executor = self._kill_workers()
+        _wait_until(lambda: executor._broken)
+        # 池已损坏但任务还没执行：换新池后照常完成
+        self._assert_round_trip(b"after crash")
+        self.assertIsNot(self.pool._executor, executor)
+
+    def test_worker_killed_mid_job(self):
+        errors = []
+
+        def run():
+            try:
+                self.pool.encode(os.urandom(8 << 20), "bin", "", "", 2)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        _wait_until(lambda: self.pool._executor is not None and self.pool._executor._pending_work_items)
+        _wait_until(lambda: self.pool._executor._processes)
+        executor = self._kill_workers()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], WorkerCrashed)
+        self._assert_round_trip(b"after crash")
+        self.assertIsNot(self.pool._executor, executor)
+        self.assertEqual(self.pool.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()